@@ -0,0 +1,143 @@
+"""Benchmark the adaptive embedding pipeline against a local fake embedding server.
+
+The fake server answers POST /embed {"texts": [...]} with deterministic vectors after a
+simulated latency, and returns 429 once more than --rate-limit requests arrive within a
+second. Usage:
+
+    python bench_embeddings.py --rate-limit 20 --latency 0.3
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from embedding_pipeline import AdaptiveEmbeddingPipeline
+from page_reader import iter_pages
+
+
+class FakeEmbeddingServer(ThreadingHTTPServer):
+    """HTTP embedding endpoint simulating per-request latency and a requests-per-second quota"""
+
+    daemon_threads = True
+
+    def __init__(self, latency=0.3, per_text_latency=0.005, rate_limit=20, dimensions=768, port=0):
+        super().__init__(('127.0.0.1', port), _FakeEmbeddingHandler)
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+        self.rate_limit = rate_limit
+        self.dimensions = dimensions
+        self.requests = 0
+        self.rejected = 0
+        self._recent = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/embed"
+
+    def admit(self):
+        """Sliding one-second window rate limiter"""
+        now = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            while self._recent and now - self._recent[0] > 1.0:
+                self._recent.popleft()
+            if len(self._recent) >= self.rate_limit:
+                self.rejected += 1
+                return False
+            self._recent.append(now)
+            return True
+
+    def vector(self, text):
+        seed = hashlib.sha256(text.encode('utf-8')).digest()
+        return [(seed[i % len(seed)] - 128) / 128 for i in range(self.dimensions)]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _FakeEmbeddingHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        texts = json.loads(self.rfile.read(int(self.headers['Content-Length'])))["texts"]
+        if not self.server.admit():
+            self.send_response(429)
+            self.end_headers()
+            return
+        time.sleep(self.server.latency + self.server.per_text_latency * len(texts))
+        body = json.dumps({"embeddings": [self.server.vector(text) for text in texts]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def http_embed_batch(url):
+    """Build an embed_batch function calling the fake server"""
+    def embed_batch(texts):
+        request = urllib.request.Request(
+            url,
+            data=json.dumps({"texts": texts}).encode(),
+            headers={'Content-Type': 'application/json'}
+        )
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())["embeddings"]
+    return embed_batch
+
+
+def load_chunks(txt_dir, chunk_chars):
+    """Cut the SFCR pages into fixed-size chunks standing in for index nodes"""
+    chunks = []
+    for path in sorted(glob.glob(os.path.join(txt_dir, '*.txt'))):
+        for _, text in iter_pages(path):
+            chunks.extend(text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars))
+    return chunks
+
+
+def run(label, server, texts, pipeline):
+    server.requests = server.rejected = 0
+    start = time.perf_counter()
+    vectors = pipeline.embed(texts, http_embed_batch(server.url))
+    elapsed = time.perf_counter() - start
+    assert len(vectors) == len(texts) and all(v is not None for v in vectors)
+    print(
+        f"{label:<10} {len(texts)} chunks in {elapsed:6.2f}s "
+        f"({len(texts) / elapsed:7.1f} chunks/s), {server.requests} requests, "
+        f"{server.rejected} rejected, final batch={pipeline.batch_size} "
+        f"concurrency={pipeline.concurrency}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--txt-dir', default='txt_files')
+    parser.add_argument('--chunk-chars', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.3)
+    parser.add_argument('--rate-limit', type=int, default=20)
+    args = parser.parse_args()
+
+    texts = load_chunks(args.txt_dir, args.chunk_chars)
+    server = FakeEmbeddingServer(latency=args.latency, rate_limit=args.rate_limit).start()
+    try:
+        # Serial batches of 10, like LlamaIndex's default embedding batching
+        run("serial", server, texts, AdaptiveEmbeddingPipeline(
+            batch_size=10, max_batch_size=10, concurrency=1, max_concurrency=1, backoff=0.1
+        ))
+        run("adaptive", server, texts, AdaptiveEmbeddingPipeline(backoff=0.1))
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Benchmark retrieval latency, recall and memory of the vector stores against corpus size.
+
+Clustered random vectors stand in for chunk embeddings, or with --index-cache the
+embeddings of the persisted SFCR shards are used and queries are perturbed corpus
+rows. Recall@k is measured against exact float32 search. Usage:
+
+    python bench_vector_store.py --sizes 1000 10000 50000 --dim 768 --nprobe 4 8 16
+    python bench_vector_store.py --index-cache index_cache --stores numpy --dtypes float32 float16 int8
+"""
+import argparse
+import glob
+import os
+import time
+
+import numpy as np
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores import SimpleVectorStore
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from index_store import CURRENT_FILE
+from vector_stores import DEFAULT_PERSIST_FNAME, IVFFlatVectorStore, NumpyVectorStore
+
+STORES = {
+    "simple": SimpleVectorStore,
+    "numpy": NumpyVectorStore,
+    "ivf": IVFFlatVectorStore,
+}
+
+
+def make_nodes(vectors):
+    return [
+        TextNode(id_=f"node-{i}", text="", embedding=vector.tolist())
+        for i, vector in enumerate(vectors)
+    ]
+
+
+def make_vectors(rng, centers, size):
+    """Vectors grouped around random topics, closer to real embeddings than uniform noise"""
+    noise = rng.standard_normal((size, centers.shape[1])).astype(np.float32)
+    return centers[rng.integers(0, centers.shape[0], size)] + 0.5 * noise
+
+
+def load_corpus(index_cache):
+    """Embeddings of the published snapshot of every persisted shard"""
+    matrices = []
+    for pointer in sorted(glob.glob(os.path.join(index_cache, '*', CURRENT_FILE))):
+        with open(pointer, encoding='utf-8') as f:
+            snapshot_dir = os.path.join(os.path.dirname(pointer), f.read().strip())
+        path = os.path.join(snapshot_dir, os.path.splitext(DEFAULT_PERSIST_FNAME)[0] + '.npy')
+        # Older snapshots, kept for readers of the previous pointer, are not counted twice
+        if os.path.exists(path):
+            matrices.append(np.load(path))
+    if not matrices:
+        raise SystemExit(f"No persisted shard found in {index_cache}")
+    return np.concatenate(matrices)
+
+
+def recall(results, exact):
+    """Mean fraction of the exact top-k found by each query"""
+    return float(np.mean([len(set(found) & set(truth)) / len(truth) for found, truth in zip(results, exact)]))
+
+
+def time_queries(store, queries, top_k):
+    """Mean query latency in milliseconds and the ids returned for each query"""
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        result = store.query(VectorStoreQuery(query_embedding=query.tolist(), similarity_top_k=top_k))
+        results.append(result.ids)
+    return (time.perf_counter() - start) * 1000 / len(queries), results
+
+
+def resident_mb(store):
+    if hasattr(store, "resident_bytes"):
+        return f"{store.resident_bytes() / 2 ** 20:.1f}"
+    return "-"
+
+
+def bench(args, vectors, queries):
+    nodes = make_nodes(vectors)
+    exact_store = NumpyVectorStore()
+    exact_store.add(nodes)
+    _, exact = time_queries(exact_store, queries, args.top_k)
+
+    for name in args.stores:
+        for dtype in (args.dtypes if name != "simple" else [None]):
+            if name == "simple":
+                store = SimpleVectorStore()
+            elif name == "ivf":
+                store = IVFFlatVectorStore(dtype=dtype, min_train_size=0)
+            else:
+                store = NumpyVectorStore(dtype=dtype)
+            start = time.perf_counter()
+            store.add(nodes)
+            if hasattr(store, "train"):
+                store.train()
+            build = time.perf_counter() - start
+            for nprobe in (args.nprobe if name == "ivf" else [None]):
+                if nprobe is not None:
+                    store.nprobe = nprobe
+                latency, results = time_queries(store, queries, args.top_k)
+                print(
+                    f"{name:<8} {dtype or '-':<8} {len(vectors):>8} {nprobe or '-':>7} {build:>9.2f} "
+                    f"{latency:>9.2f} {recall(results, exact):>7.3f} {resident_mb(store):>8}"
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 20000])
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--stores', nargs='+', default=list(STORES), choices=list(STORES))
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--dtypes', nargs='+', default=['float32'], choices=['float32', 'float16', 'int8'])
+    parser.add_argument('--index-cache', help="Benchmark on the embeddings persisted in this directory")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(
+        f"{'store':<8} {'dtype':<8} {'size':>8} {'nprobe':>7} {'build s':>9} "
+        f"{'query ms':>9} {'recall':>7} {'RAM MB':>8}"
+    )
+    if args.index_cache:
+        vectors = load_corpus(args.index_cache)
+        picked = vectors[rng.integers(0, vectors.shape[0], args.queries)]
+        queries = picked + 0.05 * rng.standard_normal(picked.shape).astype(np.float32)
+        bench(args, vectors, queries)
+        return
+
+    for size in args.sizes:
+        centers = rng.standard_normal((64, args.dim)).astype(np.float32)
+        bench(args, make_vectors(rng, centers, size), make_vectors(rng, centers, args.queries))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Prebuild the index shards and tables of every report, so the app starts warm after a deploy.
+
+Files are ingested in parallel with the app's settings (config.AppConfig). A shard that
+is already current is only loaded, any other is published as a new snapshot, and
+throughput is printed per file and overall.
+Needs GOOGLE_API_KEY. Usage:
+
+    python build_indexes.py --txt-dir txt_files --workers 4
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from config import AppConfig, indexing_config
+from index_store import IndexStore
+from indexing_worker import create_embed_model
+from table_store import TableStore
+
+
+def build_file(store, tables, embed_model, file_path):
+    """Sync the shard and tables of one file, returning its ingest report and the seconds it took"""
+    start = time.perf_counter()
+    _, report = store.sync_shard(file_path, embed_model=embed_model)
+    tables.sync_file(file_path)
+    return report, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--txt-dir', default='txt_files')
+    parser.add_argument('--workers', type=int, default=4, help="Files ingested in parallel")
+    args = parser.parse_args()
+
+    api_key = os.environ.get("GOOGLE_API_KEY")
+    if not api_key:
+        parser.error("GOOGLE_API_KEY is not set")
+    files = sorted(glob.glob(os.path.join(args.txt_dir, '*.txt')))
+    if not files:
+        parser.error(f"No .txt file in {args.txt_dir}")
+
+    config = indexing_config()
+    # Shards are only published, none is kept in memory
+    store = IndexStore(**config["index"], memory_budget=0)
+    tables = TableStore(AppConfig.TABLE_STORE_PATH)
+    embed_model = create_embed_model(api_key, config)
+
+    print(f"{'file':<45} {'pages':>6} {'changed':>8} {'embedded':>9} {'reused':>7} {'seconds':>8}  snapshot")
+    totals = {"pages": 0, "embedded": 0, "reused": 0}
+    failed = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(build_file, store, tables, embed_model, f): f for f in files}
+        for future in as_completed(futures):
+            file_path = futures[future]
+            try:
+                report, seconds = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"{os.path.basename(file_path):<45} failed: {e}", file=sys.stderr)
+                continue
+            totals["pages"] += report.pages_total
+            totals["embedded"] += report.nodes_embedded
+            totals["reused"] += report.embeddings_saved
+            print(
+                f"{report.file:<45} {report.pages_total:>6} {report.pages_changed:>8} "
+                f"{report.nodes_embedded:>9} {report.embeddings_saved:>7} {seconds:>8.1f}  "
+                f"{store.snapshot(file_path)}"
+            )
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"{len(files) - failed}/{len(files)} files, {totals['pages']} pages in {elapsed:.1f} s: "
+        f"{totals['pages'] / elapsed:.1f} pages/s, {totals['embedded'] / elapsed:.1f} chunks embedded/s, "
+        f"{totals['reused']} embeddings reused"
+    )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
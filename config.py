@@ -0,0 +1,103 @@
+"""Settings of the document chat app, shared with the indexing worker and build_indexes.py"""
+from dataclasses import dataclass
+
+
+@dataclass
+class AppConfig:
+    """Configuration class for application settings"""
+    CHUNK_SIZE: int = 512
+    CHUNK_OVERLAP: int = 50
+    TOP_K_RESULTS: int = 5
+    MAX_TOKENS: int = 1024
+    DEFAULT_TEMPERATURE: float = 0.3
+    LOG_FILE: str = 'app.log'
+    EVAL_TEMPERATURE: float = 0.2  # Lower temperature for more consistent evaluations
+    EMBEDDING_MODEL: str = "models/embedding-001"
+    INDEX_CACHE_DIR: str = 'index_cache'
+    EMBEDDING_CACHE_PATH: str = 'index_cache/embeddings.sqlite3'
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 200_000
+    EMBED_BATCH_SIZE: int = 32  # Initial batch size, adapted to observed latency and 429s
+    EMBED_MAX_BATCH_SIZE: int = 100  # Gemini batch embedding request limit
+    EMBED_CONCURRENCY: int = 4
+    EMBED_MAX_CONCURRENCY: int = 16
+    EMBED_TARGET_LATENCY: float = 2.0  # Seconds per batch above which the batch size is halved; 429s halve parallelism
+    EMBED_INPUT_BATCH_SIZE: int = 2048  # Chunks handed at once to the embedding pipeline
+    VECTOR_STORE: str = 'flat'  # 'flat' (exact search) or 'ivf' (approximate, for large corpora)
+    IVF_NLIST: int = 256  # Number of k-means cells
+    IVF_NPROBE: int = 8  # Cells searched per query; higher is slower but more accurate
+    IVF_TRAIN_ITERATIONS: int = 10
+    IVF_MIN_TRAIN_SIZE: int = 4096  # Smaller stores are searched exhaustively
+    EMBEDDING_DTYPE: str = 'float32'  # 'float16' or 'int8' keep a compact copy in memory
+    RESCORE_FACTOR: int = 4  # Quantized search rescores TOP_K_RESULTS * RESCORE_FACTOR candidates exactly
+    HYBRID_RETRIEVAL: bool = True  # Fuse BM25 and vector rankings
+    FUSION_CANDIDATE_FACTOR: int = 4  # Each ranking contributes TOP_K_RESULTS * this many candidates
+    RRF_K: int = 60
+    RETRIEVAL_WORKERS: int = 8  # Shards searched in parallel
+    SECTION_ROUTING: bool = True  # Search only the report sections a question is about
+    SUMMARY_TREE: bool = False  # Summarize sections and pages with the LLM once, then search them first
+    SUMMARY_TOP_SECTIONS: int = 3
+    SUMMARY_TOP_PAGES: int = 6
+    SUMMARY_CONCURRENCY: int = 4  # Parallel LLM calls while summarizing
+    INDEXING_WORKER: bool = False  # Queue index builds for indexing_worker.py processes instead of embedding in the app
+    JOB_SPOOL_DIR: str = 'index_cache/jobs'
+    INDEX_MEMORY_BUDGET: int = 2 * 1024 ** 3  # Bytes of index shards kept in memory across sessions
+    TABLE_STORE_PATH: str = 'index_cache/tables.sqlite3'
+    TABLE_RESULTS_LIMIT: int = 10
+
+    # Latest Gemini Models
+    GEMINI_MODELS = {
+        "Gemini 1.5 Pro": "gemini-1.5-pro-latest",
+        "Gemini 2.0 Flash": "gemini-2.0-flash-exp"
+    }
+
+    # Chat answers with retrieval and the LLM, SQL answers from the extracted tables only
+    QUERY_MODES = ["Chat", "Tables (SQL)"]
+
+    # Evaluation criteria
+    EVALUATION_CRITERIA = [
+        "Relevance to the original query",
+        "Accuracy of information",
+        "Clarity and coherence",
+        "Comprehensiveness",
+        "Use of context from provided documents"
+    ]
+
+
+def vector_store_params():
+    """Build and search parameters of the configured vector store"""
+    params = {
+        "dtype": AppConfig.EMBEDDING_DTYPE,
+        "rescore_factor": AppConfig.RESCORE_FACTOR,
+    }
+    if AppConfig.VECTOR_STORE == 'ivf':
+        params.update({
+            "nlist": AppConfig.IVF_NLIST,
+            "nprobe": AppConfig.IVF_NPROBE,
+            "train_iterations": AppConfig.IVF_TRAIN_ITERATIONS,
+            "min_train_size": AppConfig.IVF_MIN_TRAIN_SIZE,
+        })
+    return params
+
+
+def indexing_config():
+    """Settings of the index shards and of their embedding, as sent to the indexing worker"""
+    return {
+        "index": {
+            "persist_dir": AppConfig.INDEX_CACHE_DIR,
+            "chunk_size": AppConfig.CHUNK_SIZE,
+            "chunk_overlap": AppConfig.CHUNK_OVERLAP,
+            "embed_model_name": AppConfig.EMBEDDING_MODEL,
+            "vector_store": AppConfig.VECTOR_STORE,
+            "vector_store_params": vector_store_params(),
+        },
+        "embedding": {
+            "cache_path": AppConfig.EMBEDDING_CACHE_PATH,
+            "cache_max_entries": AppConfig.EMBEDDING_CACHE_MAX_ENTRIES,
+            "batch_size": AppConfig.EMBED_BATCH_SIZE,
+            "max_batch_size": AppConfig.EMBED_MAX_BATCH_SIZE,
+            "concurrency": AppConfig.EMBED_CONCURRENCY,
+            "max_concurrency": AppConfig.EMBED_MAX_CONCURRENCY,
+            "target_latency": AppConfig.EMBED_TARGET_LATENCY,
+            "input_batch_size": AppConfig.EMBED_INPUT_BATCH_SIZE,
+        },
+    }
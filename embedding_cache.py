@@ -0,0 +1,175 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+# Reads only note when entries were used; the notes are written in batches of this size, or with the next put
+TOUCH_BATCH_SIZE = 1000
+TOUCH_INTERVAL = 30.0  # Seconds after which noted reads are written anyway
+# Eviction goes this far below the size bound, so the entries are not recounted on every put of a full cache
+EVICTION_SLACK = 0.1
+
+
+class EmbeddingCache:
+    """SQLite store of embedding vectors keyed by hash(model name, text), evicting least recently used
+
+    Reads do not write: the last use of the entries found is noted in memory
+    and written in batches. The number of entries is kept as a running count,
+    recounted after each eviction since other processes share the file.
+    """
+
+    def __init__(self, path, max_entries):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS embeddings '
+            '(key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)')
+        self._conn.commit()
+        self._entries = self._count()
+        self._touched = {}  # key -> time of its last read, not written yet
+        self._touched_since = time.monotonic()
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def key(model_name, text):
+        return hashlib.sha256(f"{model_name}\0{text}".encode('utf-8')).hexdigest()
+
+    def get_many(self, model_name, texts):
+        """Return the cached vector of each text, or None where it is missing"""
+        keys = [self.key(model_name, text) for text in texts]
+        found = {}
+        with self._lock:
+            # Stay below SQLite's limit on the number of bound parameters
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+                found.update((key, array('f', blob).tolist()) for key, blob in rows)
+            if found:
+                now = time.time()
+                self._touched.update((key, now) for key in found)
+                if (len(self._touched) >= TOUCH_BATCH_SIZE
+                        or time.monotonic() - self._touched_since >= TOUCH_INTERVAL):
+                    self._write_touched()
+                    self._conn.commit()
+            self.hits += sum(key in found for key in keys)
+            self.misses += sum(key not in found for key in keys)
+        return [found.get(key) for key in keys]
+
+    def put_many(self, model_name, texts, vectors):
+        """Store vectors for texts, then evict the least recently used entries over the size bound"""
+        now = time.time()
+        rows = [
+            (self.key(model_name, text), array('f', vector).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._write_touched()
+            # A text stored meanwhile by another thread or process already has its vector
+            changes = self._conn.total_changes
+            self._conn.executemany('INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?)', rows)
+            self._entries += self._conn.total_changes - changes
+            if self._entries > self.max_entries:
+                evicted = self._entries - int(self.max_entries * (1 - EVICTION_SLACK))
+                self._conn.execute(
+                    'DELETE FROM embeddings WHERE key IN '
+                    '(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)',
+                    (evicted,)
+                )
+                self._entries = self._count()
+                self.logger.info(f"Evicted {evicted} embeddings from cache")
+            self._conn.commit()
+
+    def _write_touched(self):
+        """Write the noted last uses, within the caller's transaction"""
+        if self._touched:
+            self._conn.executemany(
+                'UPDATE embeddings SET last_used = ? WHERE key = ?',
+                [(last_used, key) for key, last_used in self._touched.items()]
+            )
+            self._touched = {}
+        self._touched_since = time.monotonic()
+
+    def _count(self):
+        return self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        """Return hit/miss counters and the number of cached vectors"""
+        with self._lock:
+            entries = self._entries
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate, "entries": entries}
+
+
+class CachedEmbedding(BaseEmbedding):
+    """Embedding model that consults an EmbeddingCache before calling the wrapped model"""
+
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _cache: EmbeddingCache = PrivateAttr()
+    _pipeline: object = PrivateAttr(default=None)
+
+    def __init__(self, embed_model, cache, pipeline=None, **kwargs):
+        kwargs.setdefault('embed_batch_size', embed_model.embed_batch_size)
+        super().__init__(model_name=embed_model.model_name, **kwargs)
+        self._embed_model = embed_model
+        self._cache = cache
+        self._pipeline = pipeline
+
+    @classmethod
+    def class_name(cls):
+        return "CachedEmbedding"
+
+    def _embed_with_cache(self, namespace, texts, embed_missing):
+        """Look texts up in the cache and embed only the missing ones"""
+        vectors = self._cache.get_many(namespace, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            embedded = embed_missing(missing_texts)
+            self._cache.put_many(namespace, missing_texts, embedded)
+            for i, vector in zip(missing, embedded):
+                vectors[i] = vector
+        return vectors
+
+    def _get_query_embedding(self, query):
+        return self._embed_with_cache(
+            f"{self.model_name}:query",
+            [query],
+            lambda texts: [self._embed_model.get_query_embedding(texts[0])]
+        )[0]
+
+    async def _aget_query_embedding(self, query):
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text):
+        return self._get_text_embeddings([text])[0]
+
+    def _embed_texts(self, texts):
+        """Embed cache misses, through the adaptive pipeline when one is configured"""
+        if self._pipeline is None:
+            return self._embed_model.get_text_embedding_batch(texts)
+        return self._pipeline.embed(texts, self._embed_model.get_text_embedding_batch)
+
+    def _get_text_embeddings(self, texts):
+        return self._embed_with_cache(self.model_name, texts, self._embed_texts)
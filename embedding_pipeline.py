@@ -0,0 +1,107 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+def is_rate_limited(error):
+    """Tell whether an embedding API error is a 429 / quota exhaustion"""
+    if getattr(error, 'code', None) == 429 or getattr(error, 'status', None) == 429:
+        return True
+    message = str(error).lower()
+    return '429' in message or 'resource exhausted' in message or 'rate limit' in message
+
+
+class AdaptiveEmbeddingPipeline:
+    """Embed texts in concurrent batches, adapting batch size and parallelism AIMD-style
+
+    Every batch answered under the target latency grows the batch size additively and,
+    every few successes, the number of batches in flight. A 429 halves the number of
+    batches in flight and retries the rejected batch after an exponential backoff; a
+    batch slower than the target latency halves the batch size.
+    """
+
+    def __init__(self, batch_size=32, max_batch_size=100, concurrency=4, max_concurrency=16,
+                 target_latency=2.0, batch_size_step=8, max_retries=6, backoff=0.5):
+        self.batch_size = batch_size
+        self.max_batch_size = max_batch_size
+        self.concurrency = concurrency
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.batch_size_step = batch_size_step
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.stats = {"batches": 0, "rate_limited": 0, "errors": 0}
+        self._successes = 0
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def _increase(self):
+        with self._lock:
+            self.batch_size = min(self.max_batch_size, self.batch_size + self.batch_size_step)
+            self._successes += 1
+            if self._successes % self.concurrency == 0:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+
+    def _decrease_concurrency(self):
+        with self._lock:
+            self.concurrency = max(1, self.concurrency // 2)
+            self._successes = 0
+
+    def _decrease_batch_size(self):
+        with self._lock:
+            self.batch_size = max(1, self.batch_size // 2)
+
+    def _run_batch(self, embed_batch, texts):
+        start = time.perf_counter()
+        vectors = embed_batch(texts)
+        return vectors, time.perf_counter() - start
+
+    def embed(self, texts, embed_batch, on_progress=None):
+        """Embed texts with embed_batch(list of texts) -> list of vectors, preserving order"""
+        vectors = [None] * len(texts)
+        pending = deque([(0, len(texts), 0)])  # (start, end, attempt) ranges still to embed
+        done = 0
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            in_flight = {}
+            while pending or in_flight:
+                while pending and len(in_flight) < self.concurrency:
+                    start, end, attempt = pending.popleft()
+                    batch_end = min(end, start + self.batch_size)
+                    if batch_end < end:
+                        pending.appendleft((batch_end, end, attempt))
+                    future = executor.submit(self._run_batch, embed_batch, texts[start:batch_end])
+                    in_flight[future] = (start, batch_end, attempt)
+
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    start, end, attempt = in_flight.pop(future)
+                    try:
+                        batch_vectors, latency = future.result()
+                    except Exception as e:
+                        if attempt >= self.max_retries:
+                            raise
+                        if is_rate_limited(e):
+                            self.stats["rate_limited"] += 1
+                            self._decrease_concurrency()
+                        else:
+                            self.stats["errors"] += 1
+                            self.logger.warning(f"Embedding batch failed, retrying: {e}")
+                            self._decrease_batch_size()
+                        time.sleep(self.backoff * 2 ** attempt)
+                        pending.appendleft((start, end, attempt + 1))
+                        continue
+
+                    vectors[start:end] = batch_vectors
+                    done += end - start
+                    self.stats["batches"] += 1
+                    if latency > self.target_latency:
+                        self._decrease_batch_size()
+                    else:
+                        self._increase()
+                    if on_progress is not None:
+                        on_progress(done, len(texts))
+
+        return vectors
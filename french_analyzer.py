@@ -0,0 +1,124 @@
+import re
+import unicodedata
+
+# Elided articles and pronouns, matched after apostrophes were normalized to '
+ELISION_PATTERN = re.compile(r"\b(?:l|d|j|m|n|s|t|c|qu|jusqu|lorsqu|puisqu)'")
+# QRT codes such as s.23.01.01 are kept whole, everything else is split on non-alphanumerics
+TOKEN_PATTERN = re.compile(r'[a-z]\.\d{2}(?:\.\d{2}){1,2}|[a-z0-9]+')
+APOSTROPHES = str.maketrans({'’': "'", '‘': "'", '`': "'", '´': "'"})
+LIGATURES = str.maketrans({'œ': 'oe', 'æ': 'ae', 'Œ': 'oe', 'Æ': 'ae'})
+
+# The OCR often drops the apostrophe of d' and l' ("dactivite"): such tokens also index their remainder,
+# when it is one of the words the reports elide ("developpement" must not give "eveloppement")
+DROPPED_ELISION_PATTERN = re.compile(r'^[dl]([aeiouyh][a-z]{4,})$')
+ELIDED_WORDS = """
+absence absorption acceptation accord achat acquisition actif actifs action actions actionnaire activite
+actualisation adequation administrateur administration affaires affiliation agent agregation ajustement
+alea alerte allocation amelioration amortissement ampleur analyse annee annexe annulation appetence
+appetit application apport appreciation approbation approche arret article assemblee assurance assurer
+assureur attenuation audit augmentation autorite autre avancement avis ecart echelle economie effet
+efficacite efficience egalisation elaboration element eligibilite elimination emetteur emission emploi
+employeur engagement enregistrement ensemble entite entree entreprise environnement epargne equilibre
+equipe equivalence estimation etablissement etat evaluation evenement evolution examen examiner excedent
+exception exclusion execution exercice exigence existence experience expert expertise exploitation
+exposition externalisation honorabilite horizon hypothese identification identifier immeuble
+immobilisation impact imposition impot incertitude indemnisation independance indicateur inflation
+information instance instrument integralite integration integrite interet intermediaire international
+intervention invalidite inventaire investissement objectif objet obligation operation option ordre
+organe organisation organisme origine outil ouverture union unite usage utilisation
+"""
+
+STOPWORDS = frozenset("""
+a au aux avec ce ces cet cette dans de des du elle en est et etre il ils la le les leur leurs
+lui mais me meme mes moi mon ne nos notre nous on ou par pas pour qu que qui sa se ses son sur
+ta te tes toi ton tu un une vos votre vous y ete sont ont a ainsi afin entre dont lors
+the of and or to in on for by with is are was were be been this that these those it its an as
+at from what which who how does do did quel quelle quels quelles
+""".split())
+
+# English query words mapped to the French terms of the reports
+GLOSSARY = {
+    "solvency": "solvabilite",
+    "own": "propres",
+    "funds": "fonds",
+    "requirement": "exigence",
+    "requirements": "exigences",
+    "premiums": "primes",
+    "premium": "prime",
+    "written": "emises",
+    "gross": "brutes",
+    "risk": "risque",
+    "risks": "risques",
+    "governance": "gouvernance",
+    "valuation": "valorisation",
+    "technical": "techniques",
+    "reserves": "provisions",
+    "investments": "placements",
+    "investment": "placement",
+    "results": "resultats",
+    "result": "resultat",
+    "activity": "activite",
+    "underwriting": "souscription",
+    "coverage": "couverture",
+    "balance": "bilan",
+    "sheet": "bilan",
+}
+
+
+def fold_accents(text):
+    """Lowercase and strip diacritics: 'Solvabilité' -> 'solvabilite'"""
+    text = text.translate(LIGATURES).lower()
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def light_stem(token):
+    """Light French stemmer removing plural and final-e inflections only"""
+    if len(token) > 5 and token.endswith('aux'):
+        return token[:-3] + 'al'
+    if len(token) > 3 and token[-1] in 'sx' and token[-2] != 's':
+        token = token[:-1]
+    if len(token) > 4 and token.endswith('e'):
+        token = token[:-1]
+    if len(token) > 4 and token.endswith('e'):  # "-ee" participles
+        token = token[:-1]
+    return token
+
+
+ELIDED_TERMS = frozenset(light_stem(word) for word in ELIDED_WORDS.split())
+
+
+class FrenchAnalyzer:
+    """Tokenizer for French OCR text and French or English queries
+
+    Folds accents and ligatures, strips elisions (including OCR-dropped
+    apostrophes), maps a small English glossary to French, removes
+    stopwords and applies a light stemmer.
+    """
+
+    name = "french-light-v2"
+
+    def analyze(self, text):
+        """Terms of a text, in order, repeated as often as they occur"""
+        text = ELISION_PATTERN.sub(' ', fold_accents(text).translate(APOSTROPHES))
+        terms = []
+        for token in TOKEN_PATTERN.findall(text):
+            token = GLOSSARY.get(token, token)
+            if token in STOPWORDS:
+                continue
+            if '.' in token or token.isdigit():
+                terms.append(token)
+                continue
+            terms.append(light_stem(token))
+            match = DROPPED_ELISION_PATTERN.match(token)
+            if match and light_stem(match.group(1)) in ELIDED_TERMS:
+                terms.append(light_stem(match.group(1)))
+        return terms
+
+    def cache_key(self, text):
+        """Normalized form of a query, equal for accent, case, spacing and punctuation variants
+
+        Unlike the analyzed terms, it keeps stopwords and inflections:
+        "le SCR est couvert" and "le SCR n'est pas couvert" differ.
+        """
+        return ' '.join(TOKEN_PATTERN.findall(fold_accents(text).translate(APOSTROPHES)))
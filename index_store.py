@@ -0,0 +1,707 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from typing import Optional
+
+from llama_index.core import Settings, StorageContext, VectorStoreIndex, load_index_from_storage
+from llama_index.core.schema import MetadataMode
+
+from key_figures import KeyFigureIndex
+from lexical_index import BM25Index
+from metadata_index import MetadataIndex
+from node_parsers import TableAwareNodeParser
+from node_snapshot import NODES_FILE, LazyDocumentStore, NodeSnapshot, write_nodes
+from object_size import object_bytes
+from page_reader import SFCRPageReader, file_digest, iter_pages
+from sections import SectionTree
+from summary_tree import SummaryTree
+from vector_stores import SEARCH_PARAMS, create_vector_store, load_vector_store
+
+CURRENT_FILE = 'CURRENT'  # Name of the published snapshot of a shard
+DOCSTORE_FILE = 'docstore.json'  # LlamaIndex's JSON docstore, replaced by a node snapshot
+MANIFEST_FILE = 'pages.json'
+LEXICAL_FILE = 'lexical.json'
+KEY_FIGURES_FILE = 'key_figures.json'
+SECTIONS_FILE = 'sections.json'
+SUMMARIES_FILE = 'summaries.json'
+# Chunks embedded between two progress reports and cancellation checks
+EMBED_PROGRESS_BATCH = 256
+# Seconds between two cancellation checks while waiting for another ingestion of the same file
+KEY_LOCK_POLL_INTERVAL = 0.2
+# Bumped when ingestion changes the nodes it produces, e.g. their metadata, so older shards are rebuilt
+INDEX_VERSION = 8
+
+
+@dataclass
+class IndexShard:
+    """Vector index of one file and the side indexes built next to it at ingestion"""
+    file: str
+    index: VectorStoreIndex
+    lexical: BM25Index
+    key_figures: KeyFigureIndex
+    sections: SectionTree
+    metadata: MetadataIndex
+    summaries: Optional[SummaryTree] = None
+
+
+class BuildCancelled(Exception):
+    """Raised in a shard synchronization whose build was cancelled"""
+
+
+@dataclass
+class IngestReport:
+    """Summary of what a shard synchronization had to re-embed"""
+    file: str
+    pages_total: int = 0
+    pages_changed: int = 0
+    pages_removed: int = 0
+    nodes_embedded: int = 0
+    embeddings_saved: int = 0
+
+
+def shard_bytes(shard):
+    """Approximate memory held by the loaded structures of a shard: vectors, nodes and side indexes"""
+    vector_store = shard.index.vector_store
+    size, columns = 0, ()
+    if hasattr(vector_store, 'resident_bytes'):
+        size, columns = vector_store.resident_bytes(), vector_store.columns
+    # Node columns the docstore shares with the vector store are only counted once
+    return size + object_bytes(
+        shard.index.docstore, shard.lexical, shard.metadata, shard.key_figures, shard.sections, shard.summaries,
+        exclude=columns
+    )
+
+
+def summary_digests(summaries):
+    """Digests of what each node of a summary tree summarizes, to compare two trees"""
+    if summaries is None:
+        return None
+    return (
+        {id_: node.digest for id_, node in summaries.pages.items()},
+        {id_: node.digest for id_, node in summaries.sections.items()},
+    )
+
+
+class ShardLease:
+    """Hold on shards of an IndexStore, released explicitly or once the lease is garbage collected"""
+
+    def __init__(self, store, keys):
+        self.keys = list(keys)
+        self._store = store
+        # Garbage collection can run the finalizer on a thread holding the store's lock,
+        # so it only queues the release, which the store applies under its lock
+        self._finalizer = weakref.finalize(self, store._queue_release, self.keys)
+
+    def release(self):
+        self._finalizer()
+        self._store._apply_releases()
+
+
+class IndexStore:
+    """On-disk store of per-file index shards, re-embedding only the pages that changed
+
+    Loaded shards are kept in memory and can be shared read-only by every
+    session of a process. Sessions lease the shards they use; once the
+    loaded shards exceed `memory_budget` bytes, the least recently used
+    shards that no session leases are dropped from memory.
+    """
+
+    def __init__(self, persist_dir, chunk_size, chunk_overlap, embed_model_name,
+                 vector_store='flat', vector_store_params=None, memory_budget=None):
+        self.persist_dir = persist_dir
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.embed_model_name = embed_model_name
+        self.vector_store = vector_store
+        self.vector_store_params = vector_store_params or {}
+        self.reader = SFCRPageReader()
+        self.node_parser = TableAwareNodeParser(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        self.memory_budget = memory_budget
+        self._loaded = OrderedDict()  # Shards in memory, least recently used first: key -> (file digest, shard)
+        self._sizes = {}  # key -> approximate bytes of a loaded shard
+        self._refs = defaultdict(int)  # key -> number of leases
+        self._released = deque()  # Keys of released leases, not yet applied to _refs
+        self._lock = threading.Lock()
+        self._key_locks = defaultdict(threading.Lock)  # One ingestion of a file at a time
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def _text_digest(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _settings_digest(self):
+        """Hash the settings that change the content of an index"""
+        settings = {
+            "version": INDEX_VERSION,
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "node_parser": self.node_parser.class_name(),
+            "embed_model": self.embed_model_name,
+            "vector_store": self.vector_store,
+            "vector_store_params": {
+                key: value for key, value in self.vector_store_params.items()
+                if key not in SEARCH_PARAMS
+            },
+        }
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+    def shard_key(self, file_path):
+        """Build the key of a file's shard; it does not depend on the file content"""
+        digest = hashlib.sha256(self._settings_digest().encode())
+        digest.update(os.path.basename(file_path).encode())
+        return digest.hexdigest()[:32]
+
+    def _shard_dir(self, key):
+        return os.path.join(self.persist_dir, key)
+
+    def _snapshot_dir(self, key):
+        """Directory of the published snapshot of a shard, or None if there is none"""
+        try:
+            with open(os.path.join(self._shard_dir(key), CURRENT_FILE), encoding='utf-8') as f:
+                snapshot = f.read().strip()
+        except OSError:
+            return None
+        return os.path.join(self._shard_dir(key), snapshot) if snapshot else None
+
+    @staticmethod
+    def _load_manifest(snapshot_dir):
+        try:
+            with open(os.path.join(snapshot_dir, MANIFEST_FILE), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def snapshot(self, file_path):
+        """Name of the published snapshot of a file's shard, or None"""
+        snapshot_dir = self._snapshot_dir(self.shard_key(file_path))
+        return os.path.basename(snapshot_dir) if snapshot_dir is not None else None
+
+    def is_current(self, file_path):
+        """Whether the published snapshot of a file's shard was built from its current content"""
+        snapshot_dir = self._snapshot_dir(self.shard_key(file_path))
+        manifest = self._load_manifest(snapshot_dir) if snapshot_dir is not None else None
+        return manifest is not None and manifest["file_digest"] == file_digest(file_path)
+
+    def load(self, snapshot_dir, file_name, rebuilt=None):
+        """Load a persisted shard snapshot, or return None if there is none
+
+        Side indexes persisted in an outdated format are rebuilt from the
+        nodes; their file names are appended to the `rebuilt` list.
+        """
+        rebuilt = [] if rebuilt is None else rebuilt
+        if not os.path.isdir(snapshot_dir):
+            return None
+        vector_store = load_vector_store(snapshot_dir, **{
+            name: value for name, value in self.vector_store_params.items()
+            if name in SEARCH_PARAMS
+        })
+        docstore = None
+        if os.path.exists(os.path.join(snapshot_dir, NODES_FILE)):
+            # Node texts stay in the snapshot's blob until a retriever fetches them, and node ids
+            # and metadata are read from the vector store
+            docstore = LazyDocumentStore(NodeSnapshot(snapshot_dir, columns=vector_store.share_columns()))
+        storage_context = StorageContext.from_defaults(
+            persist_dir=snapshot_dir,
+            docstore=docstore,
+            vector_store=vector_store
+        )
+        index = load_index_from_storage(storage_context)
+
+        try:
+            lexical = BM25Index.from_persist_path(os.path.join(snapshot_dir, LEXICAL_FILE))
+        except (OSError, ValueError) as e:
+            self.logger.info(f"Rebuilding lexical index of {file_name}: {e}")
+            lexical = BM25Index()
+            lexical.add_nodes(index.docstore.docs.values())
+            rebuilt.append(LEXICAL_FILE)
+
+        try:
+            key_figures = KeyFigureIndex.from_persist_path(os.path.join(snapshot_dir, KEY_FIGURES_FILE))
+        except (OSError, ValueError, TypeError) as e:
+            self.logger.info(f"Rebuilding key figures of {file_name}: {e}")
+            key_figures = KeyFigureIndex()
+            for node in index.docstore.docs.values():
+                key_figures.add_page(node.metadata.get("page", 0), node.get_content())
+            rebuilt.append(KEY_FIGURES_FILE)
+        summaries_path = os.path.join(snapshot_dir, SUMMARIES_FILE)
+        summaries = SummaryTree.from_persist_path(summaries_path) if os.path.exists(summaries_path) else None
+        return IndexShard(
+            file=file_name,
+            index=index,
+            lexical=lexical,
+            key_figures=key_figures,
+            sections=SectionTree.from_persist_path(os.path.join(snapshot_dir, SECTIONS_FILE)),
+            metadata=(
+                MetadataIndex.from_metadata(zip(docstore.snapshot.ids, docstore.snapshot.metadata))
+                if docstore is not None else MetadataIndex.from_nodes(index.docstore.docs.values())
+            ),
+            summaries=summaries
+        )
+
+    def save(self, key, shard, manifest):
+        """Persist a shard as a new snapshot, then publish it by atomically swapping the CURRENT pointer
+
+        Readers, in this or another process, see either the previous snapshot
+        or the new one; all but these two are then removed.
+        """
+        shard_dir = self._shard_dir(key)
+        os.makedirs(shard_dir, exist_ok=True)
+        previous = self._snapshot_dir(key)
+        snapshot = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        tmp_dir = tempfile.mkdtemp(prefix='.snapshot-', dir=shard_dir)
+        try:
+            shard.index.storage_context.persist(persist_dir=tmp_dir)
+            # Node texts go to a blob read without parsing, instead of the JSON docstore, in the
+            # vector store's row order so the snapshot reads its ids and metadata from it
+            docs = shard.index.docstore.docs
+            write_nodes(tmp_dir, [docs[node_id] for node_id in shard.index.vector_store.columns[0]])
+            if os.path.exists(os.path.join(tmp_dir, DOCSTORE_FILE)):
+                os.remove(os.path.join(tmp_dir, DOCSTORE_FILE))
+            shard.lexical.persist(os.path.join(tmp_dir, LEXICAL_FILE))
+            shard.key_figures.persist(os.path.join(tmp_dir, KEY_FIGURES_FILE))
+            shard.sections.persist(os.path.join(tmp_dir, SECTIONS_FILE))
+            if shard.summaries is not None:
+                shard.summaries.persist(os.path.join(tmp_dir, SUMMARIES_FILE))
+            with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+                json.dump(manifest, f)
+            os.replace(tmp_dir, os.path.join(shard_dir, snapshot))
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        fd, tmp_pointer = tempfile.mkstemp(prefix='.current-', dir=shard_dir)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(snapshot)
+        os.replace(tmp_pointer, os.path.join(shard_dir, CURRENT_FILE))
+
+        # The previous snapshot is kept for readers that resolved the pointer before the swap
+        kept = {snapshot, os.path.basename(previous) if previous else None}
+        for name in os.listdir(shard_dir):
+            path = os.path.join(shard_dir, name)
+            if name not in kept and not name.startswith('.') and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def lease(self, file_paths):
+        """Pin the shards of some files in memory until the returned lease is released"""
+        keys = [self.shard_key(file_path) for file_path in file_paths]
+        with self._lock:
+            self._drain_releases()
+            for key in keys:
+                self._refs[key] += 1
+        return ShardLease(self, keys)
+
+    def _queue_release(self, keys):
+        # Takes no lock: deque appends are atomic
+        self._released.append(keys)
+
+    def _apply_releases(self):
+        with self._lock:
+            self._evict()
+
+    def _drain_releases(self):
+        """Apply the queued lease releases; called with the lock held"""
+        while self._released:
+            for key in self._released.popleft():
+                self._refs[key] -= 1
+                if self._refs[key] <= 0:
+                    del self._refs[key]
+
+    def _cache(self, key, content_digest, shard):
+        size = shard_bytes(shard)
+        with self._lock:
+            self._loaded[key] = (content_digest, shard)
+            self._loaded.move_to_end(key)
+            self._sizes[key] = size
+            self._evict()
+
+    def _evict(self):
+        """Drop the least recently used unleased shards until the loaded ones fit the budget"""
+        self._drain_releases()
+        if self.memory_budget is None:
+            return
+        total = sum(self._sizes.values())
+        for key in list(self._loaded):
+            if total <= self.memory_budget:
+                break
+            if self._refs.get(key):
+                continue
+            del self._loaded[key]
+            total -= self._sizes.pop(key)
+            self.logger.info(f"Evicted index shard {key} from memory")
+
+    def memory_stats(self):
+        with self._lock:
+            # Shards whose last lease was garbage collected are evicted before being counted
+            self._evict()
+            return {
+                "shards": len(self._loaded),
+                "leased": sum(1 for key in self._loaded if self._refs.get(key)),
+                "bytes": sum(self._sizes.values()),
+            }
+
+    def sync_shard(self, file_path, embed_model=None, progress=None, cancelled=None):
+        """Return the up-to-date shard of a file and a report of the embeddings it needed
+
+        `progress(embedded, total)` is called as the file's new chunks are
+        embedded. Setting the `cancelled` event stops the synchronization
+        between two embedding batches, or while it waits for another
+        ingestion of the file, with BuildCancelled, leaving the shard as it was.
+        """
+        key = self.shard_key(file_path)
+        # Concurrent sessions wait for one another instead of ingesting the same file twice
+        with self._key_lock(key, cancelled):
+            return self._sync_shard(key, file_path, embed_model, progress, cancelled)
+
+    @contextmanager
+    def _key_lock(self, key, cancelled=None):
+        """Hold the ingestion lock of a shard, waiting for it until `cancelled` is set"""
+        with self._lock:
+            lock = self._key_locks[key]
+        while not lock.acquire(timeout=KEY_LOCK_POLL_INTERVAL):
+            if cancelled is not None and cancelled.is_set():
+                raise BuildCancelled()
+        try:
+            yield
+        finally:
+            lock.release()
+
+    def _sync_shard(self, key, file_path, embed_model, progress, cancelled):
+        file_name = os.path.basename(file_path)
+        content_digest = file_digest(file_path)
+
+        with self._lock:
+            loaded = self._loaded.get(key)
+            if loaded is not None:
+                self._loaded.move_to_end(key)
+        if loaded is not None and loaded[0] == content_digest:
+            return loaded[1], IngestReport(file=file_name)
+
+        snapshot_dir = self._snapshot_dir(key)
+        manifest = self._load_manifest(snapshot_dir) if snapshot_dir is not None else None
+        shard, rebuilt = None, []
+        if manifest is not None:
+            # A fresh copy, possibly published by an indexing worker; an update then never
+            # modifies the shard other sessions are reading
+            try:
+                shard = self.load(snapshot_dir, file_name, rebuilt)
+            except Exception as e:
+                self.logger.warning(f"Discarding unreadable index shard {file_name}: {e}")
+        if shard is None:
+            manifest = None
+
+        if manifest is not None and manifest["file_digest"] == content_digest:
+            self.logger.info(f"Loaded index shard {file_name} from cache")
+            if rebuilt:
+                # Published again so the rebuild, e.g. after an analyzer change, happens once
+                try:
+                    self.save(key, shard, manifest)
+                except Exception as e:
+                    self.logger.warning(f"Failed to persist the rebuilt {', '.join(rebuilt)} of {file_name}: {e}")
+            self._cache(key, content_digest, shard)
+            return shard, IngestReport(
+                file=file_name,
+                pages_total=len(manifest["pages"]),
+                embeddings_saved=sum(manifest["nodes"].values())
+            )
+
+        shard, manifest, report = self._reingest(file_path, shard, manifest, embed_model, progress, cancelled)
+        manifest["file_digest"] = content_digest
+        try:
+            self.save(key, shard, manifest)
+        except Exception as e:
+            # Raised so an indexing job is marked failed rather than done without a snapshot
+            self.logger.error(f"Failed to persist index shard {file_name}: {e}")
+            raise
+        self._cache(key, content_digest, shard)
+        return shard, report
+
+    @staticmethod
+    def _embed_nodes(nodes, embed_model, progress=None, cancelled=None):
+        """Embed nodes in batches, reporting progress and checking for cancellation in between"""
+        for start in range(0, len(nodes), EMBED_PROGRESS_BATCH):
+            if cancelled is not None and cancelled.is_set():
+                raise BuildCancelled()
+            batch = nodes[start:start + EMBED_PROGRESS_BATCH]
+            embeddings = embed_model.get_text_embedding_batch(
+                [node.get_content(metadata_mode=MetadataMode.EMBED) for node in batch]
+            )
+            for node, embedding in zip(batch, embeddings):
+                node.embedding = embedding
+            if progress is not None:
+                progress(start + len(batch), len(nodes))
+
+    @staticmethod
+    def _page_sections(sections, page):
+        """Sections the nodes of a page can be tagged with: the one open at its start and those it opens"""
+        opened = [sections.section_at(page, 0)] + [section for section in sections.sections if section.page == page]
+        return [(section.id, section.title, section.chapter) for section in opened if section is not None]
+
+    def _reingest(self, file_path, shard, manifest, embed_model=None, progress=None, cancelled=None):
+        """Diff page hashes against the manifest and re-embed only new or changed pages"""
+        file_name = os.path.basename(file_path)
+        old_pages = manifest["pages"] if manifest else {}
+        old_nodes = manifest["nodes"] if manifest else {}
+        report = IngestReport(file=file_name)
+
+        # Key figures and headings are cheap to extract, so they are re-read from every page
+        text_digests, key_figures, sections = {}, KeyFigureIndex(), SectionTree()
+        for document in self.reader.lazy_load_data(file_path):
+            key_figures.add_page(document.metadata["page"], document.text)
+            sections.add_page(document.metadata["page"], document.text)
+            text_digests[document.doc_id] = (document.metadata["page"], self._text_digest(document.text))
+        # A page's digest covers the sections its nodes are tagged with, so a heading
+        # added or renamed anywhere re-tags the pages it spans, not only its own
+        pages = {
+            doc_id: self._text_digest(digest + json.dumps(self._page_sections(sections, page)))
+            for doc_id, (page, digest) in text_digests.items()
+        }
+        stale = {doc_id for doc_id, page_digest in pages.items() if old_pages.get(doc_id) != page_digest}
+        report.embeddings_saved = sum(old_nodes.get(doc_id, 0) for doc_id in pages if doc_id not in stale)
+        # Only the stale pages are read again, to be chunked
+        changed = [document for document in self.reader.lazy_load_data(file_path) if document.doc_id in stale] if stale else []
+        removed = [doc_id for doc_id in old_pages if doc_id not in pages]
+        report.pages_total = len(pages)
+        report.pages_changed = len(changed)
+        report.pages_removed = len(removed)
+
+        nodes = self.node_parser.get_nodes_from_documents(changed)
+        for node in nodes:
+            section = sections.section_at(node.metadata["page"], node.start_char_idx or 0)
+            node.metadata.update({
+                "chapter": section.chapter if section else '',
+                "section": section.id if section else '',
+                "section_title": section.title if section else '',
+            })
+            node.excluded_embed_metadata_keys.extend(["chapter", "section", "section_title"])
+        report.nodes_embedded = len(nodes)
+        # Embedded before the shard is touched, so a cancelled build leaves it unchanged
+        embed_model = embed_model or Settings.embed_model
+        self._embed_nodes(nodes, embed_model, progress, cancelled)
+        if shard is None:
+            self.logger.info(f"Building index shard {file_name} ({len(nodes)} chunks)")
+            storage_context = StorageContext.from_defaults(
+                vector_store=create_vector_store(self.vector_store, **self.vector_store_params)
+            )
+            shard = IndexShard(
+                file=file_name,
+                index=VectorStoreIndex(nodes, storage_context=storage_context, embed_model=embed_model),
+                lexical=BM25Index(),
+                key_figures=key_figures,
+                sections=sections,
+                metadata=MetadataIndex()
+            )
+        else:
+            self.logger.info(
+                f"Updating index shard {file_name}: {len(changed)} pages changed, "
+                f"{len(removed)} removed, {report.embeddings_saved} embeddings reused"
+            )
+            for doc_id in removed + [doc.doc_id for doc in changed if doc.doc_id in old_pages]:
+                shard.lexical.remove_ref_doc(doc_id)
+                shard.index.delete_ref_doc(doc_id, delete_from_docstore=True)
+            shard.index.insert_nodes(nodes)
+            shard.key_figures = key_figures
+            shard.sections = sections
+        shard.lexical.add_nodes(nodes)
+        shard.metadata = MetadataIndex.from_nodes(shard.index.docstore.docs.values())
+
+        node_counts = {
+            doc_id: count for doc_id, count in old_nodes.items()
+            if doc_id in pages and pages[doc_id] == old_pages.get(doc_id)
+        }
+        for node in nodes:
+            node_counts[node.ref_doc_id] = node_counts.get(node.ref_doc_id, 0) + 1
+
+        return shard, {"pages": pages, "nodes": node_counts}, report
+
+    def _published(self, key, file_path, shard):
+        """Manifest of a shard's current snapshot, if it still matches the file, and the shard to build on
+
+        The cached shard replaces `shard` when it is the snapshot's, so summaries
+        published by another session are kept.
+        """
+        snapshot_dir = self._snapshot_dir(key)
+        manifest = self._load_manifest(snapshot_dir) if snapshot_dir is not None else None
+        if manifest is not None and manifest["file_digest"] != file_digest(file_path):
+            manifest = None  # The file changed since: its next sync rebuilds the shard
+        with self._lock:
+            loaded = self._loaded.get(key)
+        if loaded is not None and manifest is not None and loaded[0] == manifest["file_digest"]:
+            shard = loaded[1]
+        return manifest, shard
+
+    def sync_summaries(self, file_path, shard, summarize, embed_model, concurrency=4, cancelled=None):
+        """Generate the missing or stale summaries of a shard's summary tree and publish them
+
+        Shards are read-only once loaded: the summaries go to a new tree and a
+        copy of the shard, published as a new snapshot and swapped into the
+        cache. `summarize` maps a prompt to the LLM's answer. Returns the
+        up-to-date shard and the number of summaries generated. Setting the
+        `cancelled` event stops before the next LLM call with BuildCancelled,
+        publishing nothing.
+
+        The LLM is called without the shard's ingestion lock, which is only
+        taken to check that the snapshot is still the one summarized and
+        publish; summaries of a snapshot replaced meanwhile are not published.
+        """
+        file_name = os.path.basename(file_path)
+        key = self.shard_key(file_path)
+
+        def summarize_unless_cancelled(prompt):
+            if cancelled is not None and cancelled.is_set():
+                raise BuildCancelled()
+            return summarize(prompt)
+
+        manifest, shard = self._published(key, file_path, shard)
+        previous = shard.summaries
+        summaries = SummaryTree(
+            sections=previous.sections.values() if previous else None,
+            pages=previous.pages.values() if previous else None
+        )
+        generated = summaries.update(
+            dict(iter_pages(file_path)), shard.sections, summarize_unless_cancelled, embed_model, concurrency
+        )
+        if not generated:
+            return shard, 0
+        if manifest is None:
+            return replace(shard, summaries=summaries), generated
+
+        with self._key_lock(key, cancelled):
+            current, latest = self._published(key, file_path, shard)
+            if current != manifest:
+                self.logger.info(f"Not publishing summaries of {file_name}: its shard was rebuilt meanwhile")
+                return latest, generated
+            if summary_digests(latest.summaries) == summary_digests(summaries):
+                return latest, generated  # Another session published the same summaries first
+            shard = replace(latest, summaries=summaries)
+            try:
+                self.save(key, shard, manifest)
+            except Exception as e:
+                # Not cached either: the cache must not hold a shard that no snapshot backs
+                self.logger.error(f"Failed to publish summaries of {file_name}: {e}")
+                raise
+            self._cache(key, manifest["file_digest"], shard)
+        return shard, generated
+
+
+@dataclass
+class BuildProgress:
+    """Progress of a background index build, updated by its worker thread"""
+    files_total: int
+    files_done: int = 0
+    chunks_embedded: int = 0
+    chunks_total: int = 0
+    current_file: str = ''
+
+
+class IndexBuild:
+    """Sync the shards of some files on a background thread, cancellable between embedding batches and summaries
+
+    With a JobQueue, files whose shard is not current are indexed by an
+    indexing worker process instead, and the build waits for the worker to
+    publish their snapshots before loading them.
+
+    The build leases its shards from the start; the lease is handed over
+    with the shards once the build succeeds, and released otherwise.
+    """
+
+    def __init__(self, store, file_paths, embed_model=None, summarize=None, summary_concurrency=4,
+                 queue=None, job_config=None, poll_interval=0.5):
+        self.store = store
+        self.file_paths = list(file_paths)
+        self.lease = store.lease(self.file_paths)
+        self.progress = BuildProgress(files_total=len(self.file_paths))
+        self.shards = None  # Set once every shard is synced
+        self.reports = []
+        self.error = None
+        self._embed_model = embed_model
+        self._summarize = summarize
+        self._summary_concurrency = summary_concurrency
+        self._queue = queue
+        self._job_config = job_config
+        self._poll_interval = poll_interval
+        self._chunks_done = 0
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="index-build", daemon=True)
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def done(self):
+        return not self._thread.is_alive()
+
+    def wait(self, timeout=None):
+        """Wait for the build to finish, at most `timeout` seconds; returns whether it is done"""
+        self._thread.join(timeout)
+        return self.done
+
+    def _on_progress(self, embedded, total):
+        self.progress.chunks_embedded = self._chunks_done + embedded
+        self.progress.chunks_total = self._chunks_done + total
+
+    def _wait_for_job(self, file_path):
+        """Queue a file for the indexing worker and wait until its snapshot is published"""
+        job_id = self._queue.submit(file_path, self._job_config)
+        while True:
+            if self._cancelled.is_set():
+                # The job is left to the worker: another session may be waiting for the same file
+                raise BuildCancelled()
+            job = self._queue.get(job_id)
+            if job is None:
+                raise RuntimeError(f"Indexing job {job_id} disappeared")
+            if job.error is not None:
+                raise RuntimeError(f"Indexing worker failed on {os.path.basename(file_path)}: {job.error}")
+            if job.result is not None:
+                return IngestReport(**job.result)
+            if job.progress:
+                self._on_progress(job.progress["chunks_embedded"], job.progress["chunks_total"])
+            time.sleep(self._poll_interval)
+
+    def _run(self):
+        shards = []
+        try:
+            for file_path in self.file_paths:
+                self.progress.current_file = os.path.basename(file_path)
+                worker_report = None
+                if self._queue is not None and not self.store.is_current(file_path):
+                    worker_report = self._wait_for_job(file_path)
+                shard, report = self.store.sync_shard(
+                    file_path, embed_model=self._embed_model, progress=self._on_progress, cancelled=self._cancelled
+                )
+                report = worker_report or report
+                if self._summarize is not None:
+                    shard, _ = self.store.sync_summaries(
+                        file_path, shard, self._summarize, self._embed_model or Settings.embed_model,
+                        self._summary_concurrency, cancelled=self._cancelled
+                    )
+                shards.append(shard)
+                self.reports.append(report)
+                self._chunks_done += report.nodes_embedded
+                self.progress.files_done += 1
+            self.shards = shards
+        except BuildCancelled:
+            self.logger.info(f"Cancelled index build of {len(self.file_paths)} files")
+        except Exception as e:
+            self.logger.error(f"Index build error: {e}")
+            self.error = e
+        finally:
+            if self.shards is None:
+                self.lease.release()
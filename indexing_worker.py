@@ -0,0 +1,127 @@
+"""Indexing worker syncing the index shards of the document chat app in a separate process.
+
+It runs the jobs the app queues in the spool directory when AppConfig.INDEXING_WORKER
+is set. A shard that changed is published as a new snapshot that the app swaps in, so
+ingestion never competes with serving for the app's CPU and GIL. Needs GOOGLE_API_KEY. Usage:
+
+    python indexing_worker.py --spool-dir index_cache/jobs
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from dataclasses import asdict
+
+from llama_index.embeddings.gemini import GeminiEmbedding
+
+from config import AppConfig
+from embedding_cache import CachedEmbedding, EmbeddingCache
+from embedding_pipeline import AdaptiveEmbeddingPipeline
+from index_store import IndexStore
+from job_queue import JobQueue
+
+# Seconds between two progress updates of a running job
+PROGRESS_INTERVAL = 1.0
+
+
+def create_embed_model(api_key, config):
+    """Cached Gemini embedding model with the embedding settings of an indexing configuration"""
+    embedding = config["embedding"]
+    return CachedEmbedding(
+        GeminiEmbedding(
+            api_key=api_key,
+            model_name=config["index"]["embed_model_name"],
+            embed_batch_size=embedding["max_batch_size"]
+        ),
+        EmbeddingCache(embedding["cache_path"], embedding["cache_max_entries"]),
+        pipeline=AdaptiveEmbeddingPipeline(
+            batch_size=embedding["batch_size"],
+            max_batch_size=embedding["max_batch_size"],
+            concurrency=embedding["concurrency"],
+            max_concurrency=embedding["max_concurrency"],
+            target_latency=embedding["target_latency"]
+        ),
+        embed_batch_size=embedding["input_batch_size"]
+    )
+
+
+class IndexingWorker:
+    """Run queued indexing jobs one at a time, with one IndexStore and embedding model per configuration"""
+
+    def __init__(self, queue, api_key, stale_timeout=600):
+        self.queue = queue
+        self.api_key = api_key
+        self.stale_timeout = stale_timeout
+        self._stores = {}
+        self._embed_models = {}
+        self.logger = logging.getLogger(__name__)
+
+    def _store(self, config):
+        key = json.dumps(config["index"], sort_keys=True)
+        if key not in self._stores:
+            # Shards are published for the app, none is kept in this process's memory
+            self._stores[key] = IndexStore(**config["index"], memory_budget=0)
+        return self._stores[key]
+
+    def _embed_model(self, config):
+        key = json.dumps([config["index"]["embed_model_name"], config["embedding"]], sort_keys=True)
+        if key not in self._embed_models:
+            self._embed_models[key] = create_embed_model(self.api_key, config)
+        return self._embed_models[key]
+
+    def run_job(self, job):
+        """Sync the shard of a job's file and record its ingest report, or its error"""
+        last_update = 0.0
+
+        def progress(embedded, total):
+            nonlocal last_update
+            if embedded == total or time.monotonic() - last_update >= PROGRESS_INTERVAL:
+                job.progress = {"chunks_embedded": embedded, "chunks_total": total}
+                self.queue.update(job)
+                last_update = time.monotonic()
+
+        try:
+            _, report = self._store(job.config).sync_shard(
+                job.file_path, embed_model=self._embed_model(job.config), progress=progress
+            )
+        except Exception as e:
+            self.logger.error(f"Indexing job {job.id} for {job.file_path} failed: {e}")
+            self.queue.finish(job, error=str(e))
+            return
+        self.logger.info(f"Published index shard of {job.file_path}: {report.nodes_embedded} chunks embedded")
+        self.queue.finish(job, result=asdict(report))
+
+    def run(self, poll_interval=1.0, once=False):
+        """Claim and run jobs until interrupted, or until the queue is empty with `once`"""
+        while True:
+            job = self.queue.claim()
+            if job is None:
+                if once:
+                    return
+                self.queue.requeue_stale(self.stale_timeout)
+                time.sleep(poll_interval)
+                continue
+            self.logger.info(f"Indexing {job.file_path}")
+            self.run_job(job)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--spool-dir', default=AppConfig.JOB_SPOOL_DIR)
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    parser.add_argument('--stale-timeout', type=float, default=600,
+                        help="Seconds after which a running job without progress is requeued")
+    parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    api_key = os.environ.get("GOOGLE_API_KEY")
+    if not api_key:
+        parser.error("GOOGLE_API_KEY is not set")
+    worker = IndexingWorker(JobQueue(args.spool_dir), api_key, stale_timeout=args.stale_timeout)
+    worker.run(poll_interval=args.poll_interval, once=args.once)
+
+
+if __name__ == "__main__":
+    main()
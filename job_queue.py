@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+
+from page_reader import file_digest
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+STATES = (PENDING, RUNNING, DONE, FAILED)
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return 0.0
+
+
+@dataclass
+class Job:
+    """Request to sync the index shard of one file with the given IndexStore settings"""
+    id: str
+    file_path: str
+    config: dict
+    state: str = PENDING
+    submitted_at: float = 0.0
+    progress: dict = field(default_factory=dict)  # chunks_embedded and chunks_total while running
+    result: dict = None  # IngestReport of a done job
+    error: str = None
+
+
+class JobQueue:
+    """Spool directory of indexing jobs shared by the app and the indexing worker processes
+
+    Each job is a JSON file moving between the pending, running, done and
+    failed directories. Renames are atomic, so exactly one worker claims a
+    pending job, and readers never see a partially written file.
+    """
+
+    def __init__(self, spool_dir):
+        self.spool_dir = spool_dir
+        for state in STATES:
+            os.makedirs(os.path.join(spool_dir, state), exist_ok=True)
+
+    def _path(self, state, job_id):
+        return os.path.join(self.spool_dir, state, f"{job_id}.json")
+
+    def _write(self, job):
+        fd, tmp_path = tempfile.mkstemp(prefix='.job-', dir=os.path.join(self.spool_dir, job.state))
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(asdict(job), f)
+        os.replace(tmp_path, self._path(job.state, job.id))
+
+    def _read(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return Job(**json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def submit(self, file_path, config):
+        """Queue a job for the current content of a file, unless the same job is pending or running"""
+        job_id = hashlib.sha256(json.dumps(
+            [os.path.abspath(file_path), file_digest(file_path), config], sort_keys=True
+        ).encode()).hexdigest()[:32]
+        job = self.get(job_id)
+        if job is not None and job.state in (PENDING, RUNNING):
+            return job_id
+        if job is not None:
+            os.remove(self._path(job.state, job_id))
+        self._write(Job(job_id, os.path.abspath(file_path), config, submitted_at=time.time()))
+        return job_id
+
+    def get(self, job_id):
+        """Current state of a job, or None if it is unknown"""
+        for state in STATES:
+            job = self._read(self._path(state, job_id))
+            if job is not None:
+                job.state = state
+                return job
+        return None
+
+    def claim(self):
+        """Move the oldest pending job to running and return it, or None if there is none"""
+        pending_dir = os.path.join(self.spool_dir, PENDING)
+        paths = [
+            os.path.join(pending_dir, name) for name in os.listdir(pending_dir)
+            if name.endswith('.json') and not name.startswith('.')
+        ]
+        for path in sorted(paths, key=_mtime):
+            job_id = os.path.basename(path)[:-len('.json')]
+            try:
+                os.rename(path, self._path(RUNNING, job_id))
+            except FileNotFoundError:
+                continue  # Claimed by another worker
+            job = self._read(self._path(RUNNING, job_id))
+            if job is not None:
+                job.state = RUNNING
+                return job
+        return None
+
+    def update(self, job):
+        """Publish the progress of a running job"""
+        self._write(job)
+
+    def finish(self, job, result=None, error=None):
+        """Move a running job to done with its result, or to failed with its error"""
+        job.result, job.error = result, error
+        job.state = FAILED if error is not None else DONE
+        self._write(job)
+        try:
+            os.remove(self._path(RUNNING, job.id))
+        except FileNotFoundError:
+            pass
+
+    def requeue_stale(self, timeout):
+        """Move back to pending the running jobs not updated for `timeout` seconds, left by a dead worker"""
+        running_dir = os.path.join(self.spool_dir, RUNNING)
+        now = time.time()
+        for name in os.listdir(running_dir):
+            path = os.path.join(running_dir, name)
+            try:
+                if name.endswith('.json') and now - os.stat(path).st_mtime > timeout:
+                    os.rename(path, os.path.join(self.spool_dir, PENDING, name))
+            except FileNotFoundError:
+                continue
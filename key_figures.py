@@ -0,0 +1,186 @@
+import json
+import re
+from collections import Counter
+from dataclasses import asdict, dataclass
+
+from french_analyzer import APOSTROPHES, fold_accents
+
+# Metric -> (label, pattern introducing it in the reports, unit of its value)
+METRICS = {
+    "solvency_ratio": (
+        "Solvency ratio",
+        re.compile(r"ratio de (?:solvabilite|couverture du (?:scr|capital de solvabilite requis))"),
+        "%"
+    ),
+    "scr": (
+        "Solvency capital requirement (SCR)",
+        re.compile(r"\bscr\b|capital de solvabilite requis"),
+        "EUR"
+    ),
+    "mcr": (
+        "Minimum capital requirement (MCR)",
+        re.compile(r"\bmcr\b|minimum de capital requis"),
+        "EUR"
+    ),
+    "eligible_own_funds": (
+        "Eligible own funds",
+        # Own funds eligible to cover the SCR; those eligible to cover the MCR are rejected below
+        re.compile(
+            r"fonds propres (?:eligibles|disponibles et eligibles)"
+            r"(?: (?:a la couverture du|pour couvrir le|au) (?:scr|capital de solvabilite requis))?"
+            r"|eligibles? a la couverture du (?:scr|capital de solvabilite requis)"
+        ),
+        "EUR"
+    ),
+    "gross_written_premiums": (
+        "Gross premiums (turnover)",
+        # Mutual insurers report their turnover as earned premiums; a subsidiary's contribution is not the total
+        re.compile(
+            r"primes (?:brutes )?emises|(?<!contribution au )chiffre d'affaires"
+            r"|(?<!contribution aux )primes acquises(?: brutes)?"
+        ),
+        "EUR"
+    ),
+}
+
+# How questions name each metric, in English or French, once accents are folded
+QUESTION_PATTERNS = {
+    "solvency_ratio": re.compile(r"solvency ratio|coverage ratio|ratio de (?:solvabilite|couverture)|taux de couverture"),
+    "scr": re.compile(r"\bscr\b|solvency capital requirement|capital de solvabilite requis"),
+    "mcr": re.compile(r"\bmcr\b|minimum capital requirement|minimum de capital requis"),
+    "eligible_own_funds": re.compile(r"own funds|fonds propres"),
+    "gross_written_premiums": re.compile(
+        r"\bgwp\b|(?:gross )?(?:written premiums?|premiums? written|premium income|revenues?\b|turnover\b)"
+        r"|primes (?:brutes )?(?:emises|acquises)|chiffre d'affaires"
+    ),
+}
+# Explicit requests for a value: "quel est le montant du", "what were AXA's", "combien de"
+LOOKUP_PATTERN = re.compile(
+    r"(?:\b(?:quel(?:le)?s? (?:est|etait|sont|etaient)|what(?:'s| is| was| are| were)|give me"
+    r"|donne[rz]?(?:-moi)?)|\bcombien)\s+"
+    r"(?:(?:les|le|la|l'|the)\s*)?(?:[\w-]+'s\s+)?"
+    # "chiffre d'affaires" is the metric itself, not "le chiffre du SCR"
+    r"(?:(?:montant|niveau|valeur|chiffre(?! d'affaires)|amount|value|level|figure)s?\s+"
+    r"(?:du|de la|des|de l'|de|d'|of the|of)?\s*)?"
+)
+# Questions asking for more than a figure go to the LLM
+EXPLANATION_PATTERN = re.compile(
+    r"\b(?:why|how|explain\w*|pourquoi|comment|expliqu\w*|evolu\w*|compar\w*|impact\w*|analy\w*)\b"
+)
+
+AMOUNT_PATTERN = re.compile(
+    r"(?<![\d,.])(-?\d+(?: \d{3})*(?:,\d+)?) ?"
+    # The OCR often drops the euro sign of "722 M €", leaving two spaces after the M
+    r"(%|(?:milliers|millions|milliards) (?:d')?euros|(?:k|m|md) ?€|keur|meur|m(?=  ))"
+)
+# Scale of a unit, keyed by its letters
+UNIT_SCALES = {
+    "milliers": 1e3, "k": 1e3, "keur": 1e3,
+    "millions": 1e6, "m": 1e6, "meur": 1e6,
+    "milliards": 1e9, "md": 1e9,
+    "%": 1.0,
+}
+# Amounts between these words and the metric name belong to another metric
+REJECTED_CONTEXT = {
+    "scr": re.compile(r"minimum de $"),  # "minimum de capital de solvabilite requis", the MCR
+    "eligible_own_funds": re.compile(r"\bmcr\b|minimum de capital"),
+}
+# Sensitivities in the conditional ("le SCR augmenterait ... pour atteindre") are not the reported figures
+HYPOTHETICAL = re.compile(r"\b\w+(?:erait|eraient)\b")
+# Amounts right after these words are changes or prior-year figures, not the metric itself
+SKIPPED_CONTEXT = re.compile(
+    r"(?:augment\w*|hausse|baisse|diminu\w*|variation|progress\w*|recul\w*|passant|contre|de fin)"
+    r"(?: de)?\s*[+-]?\s*$"
+)
+# Figures further than this many characters from the metric name are not attributed to it
+WINDOW = 160
+SENTENCE_SPLIT = re.compile(r"\n| \. |; ")
+
+
+@dataclass
+class KeyFigure:
+    """Value of a metric read from a report page"""
+    metric: str
+    value: float
+    unit: str  # 'EUR' or '%'
+    text: str  # The figure as written in the report
+    page: int
+    snippet: str
+
+
+def extract_key_figures(page, text):
+    """Key figures stated in the sentences of a page"""
+    figures = []
+    for sentence in SENTENCE_SPLIT.split(text):
+        folded = fold_accents(sentence)
+        if HYPOTHETICAL.search(folded):
+            continue
+        for metric, (_, pattern, unit) in METRICS.items():
+            for match in pattern.finditer(folded):
+                if metric == "scr" and folded[:match.start()].endswith("couverture du "):
+                    continue  # The coverage ratio of the SCR, a percentage
+                rejected = REJECTED_CONTEXT.get(metric)
+                if rejected is not None and rejected.search(folded[max(0, match.start() - 12):match.start()]):
+                    continue
+                figure = _first_amount(folded, match.end(), unit, rejected)
+                if figure is None:
+                    continue
+                value, raw = figure
+                figures.append(KeyFigure(metric, value, unit, raw, page, sentence.strip()[:300]))
+                break
+    return figures
+
+
+def _first_amount(folded, start, unit, rejected=None):
+    """Value and text of the first amount of the expected unit after the metric name"""
+    window = folded[start:start + WINDOW]
+    for amount in AMOUNT_PATTERN.finditer(window):
+        number, amount_unit = amount.groups()
+        if (amount_unit == '%') != (unit == '%'):
+            continue
+        if rejected is not None and rejected.search(window[:amount.start()]):
+            return None
+        if SKIPPED_CONTEXT.search(window[:amount.start()]):
+            continue
+        scale = UNIT_SCALES[amount_unit.split()[0].rstrip('€')]
+        value = float(number.replace(' ', '').replace(',', '.')) * scale
+        return value, amount.group(0)
+    return None
+
+
+def metrics_in(question):
+    """Metric a question explicitly asks the value of, or an empty list when it needs more than a lookup"""
+    folded = fold_accents(question.translate(APOSTROPHES))
+    lookup = LOOKUP_PATTERN.search(folded)
+    if lookup is None or EXPLANATION_PATTERN.search(folded):
+        return []
+    # The metric must be what is asked for, not merely mentioned: "quel est le SCR", not "quelle est la composition des fonds propres"
+    asked = folded[lookup.end():]
+    return [metric for metric, pattern in QUESTION_PATTERNS.items() if pattern.match(asked)]
+
+
+class KeyFigureIndex:
+    """Key figures of one file, as extracted at ingestion"""
+
+    def __init__(self, figures=None):
+        self.figures = list(figures or [])
+
+    def add_page(self, page, text):
+        self.figures.extend(extract_key_figures(page, text))
+
+    def get(self, metric):
+        """Most often stated value of a metric, with the first page stating it, or None"""
+        candidates = [figure for figure in self.figures if figure.metric == metric]
+        if not candidates:
+            return None
+        counts = Counter(figure.value for figure in candidates)
+        return min(candidates, key=lambda figure: (-counts[figure.value], figure.page))
+
+    def persist(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump([asdict(figure) for figure in self.figures], f)
+
+    @classmethod
+    def from_persist_path(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls(KeyFigure(**figure) for figure in json.load(f))
@@ -0,0 +1,102 @@
+import json
+import math
+from collections import Counter, defaultdict
+
+from french_analyzer import FrenchAnalyzer
+
+
+class BM25Index:
+    """Inverted index scoring nodes with Okapi BM25
+
+    Node texts are analyzed once when they are added, so a query only needs
+    to be analyzed and looked up in the postings.
+    """
+
+    def __init__(self, k1=1.2, b=0.75, analyzer=None):
+        self.k1 = k1
+        self.b = b
+        self.analyzer = analyzer or FrenchAnalyzer()
+        self._docs = {}  # node id -> (ref doc id, length, term frequencies)
+        self._postings = defaultdict(dict)  # term -> {node id: term frequency}
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, node_id, text, ref_doc_id=None):
+        """Index the text of a node, replacing any previous version"""
+        if node_id in self._docs:
+            self.remove(node_id)
+        frequencies = Counter(self.analyzer.analyze(text))
+        length = sum(frequencies.values())
+        self._docs[node_id] = (ref_doc_id, length, frequencies)
+        self._total_length += length
+        for term, frequency in frequencies.items():
+            self._postings[term][node_id] = frequency
+
+    def add_nodes(self, nodes):
+        for node in nodes:
+            self.add(node.node_id, node.get_content(), node.ref_doc_id)
+
+    def remove(self, node_id):
+        entry = self._docs.pop(node_id, None)
+        if entry is None:
+            return
+        _, length, frequencies = entry
+        self._total_length -= length
+        for term in frequencies:
+            postings = self._postings[term]
+            postings.pop(node_id, None)
+            if not postings:
+                del self._postings[term]
+
+    def remove_ref_doc(self, ref_doc_id):
+        """Remove every node of a source document"""
+        for node_id in [node_id for node_id, entry in self._docs.items() if entry[0] == ref_doc_id]:
+            self.remove(node_id)
+
+    def search(self, query, top_k, node_ids=None):
+        """Best (node id, score) pairs for a query, optionally restricted to some nodes"""
+        if not self._docs:
+            return []
+        average_length = self._total_length / len(self._docs)
+        scores = defaultdict(float)
+        for term in set(self.analyzer.analyze(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (len(self._docs) - len(postings) + 0.5) / (len(postings) + 0.5))
+            for node_id, frequency in postings.items():
+                if node_ids is not None and node_id not in node_ids:
+                    continue
+                length = self._docs[node_id][1]
+                norm = self.k1 * (1 - self.b + self.b * length / average_length)
+                scores[node_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+    def persist(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "k1": self.k1,
+                "b": self.b,
+                "analyzer": self.analyzer.name,
+                "docs": {
+                    node_id: [ref_doc_id, dict(frequencies)]
+                    for node_id, (ref_doc_id, _, frequencies) in self._docs.items()
+                },
+            }, f)
+
+    @classmethod
+    def from_persist_path(cls, path, analyzer=None):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        index = cls(k1=data["k1"], b=data["b"], analyzer=analyzer)
+        if data.get("analyzer") != index.analyzer.name:
+            raise ValueError(f"Lexical index was built with analyzer {data.get('analyzer')}")
+        for node_id, (ref_doc_id, frequencies) in data["docs"].items():
+            length = sum(frequencies.values())
+            index._docs[node_id] = (ref_doc_id, length, Counter(frequencies))
+            index._total_length += length
+            for term, frequency in frequencies.items():
+                index._postings[term][node_id] = frequency
+        return index
@@ -0,0 +1,69 @@
+from llama_index.core.vector_stores.types import FilterCondition, MetadataFilters
+
+from vector_stores import metadata_matches
+
+# Node metadata keys indexed for pre-filtering
+INDEXED_KEYS = ("company", "year", "chapter", "section", "page")
+
+
+class MetadataIndex:
+    """Inverted index from node metadata values to node ids
+
+    Lets a retriever turn metadata filters into a candidate set of node ids
+    before any vector or BM25 scoring, instead of testing every node.
+    """
+
+    def __init__(self):
+        self._postings = {key: {} for key in INDEXED_KEYS}  # key -> value -> node ids
+        self._node_ids = set()
+
+    @classmethod
+    def from_nodes(cls, nodes):
+        return cls.from_metadata((node.node_id, node.metadata) for node in nodes)
+
+    @classmethod
+    def from_metadata(cls, items):
+        """Index (node id, metadata) pairs, without needing the node texts"""
+        index = cls()
+        for node_id, metadata in items:
+            index._node_ids.add(node_id)
+            for key in INDEXED_KEYS:
+                if key in metadata:
+                    index._postings[key].setdefault(metadata[key], set()).add(node_id)
+        return index
+
+    def __len__(self):
+        return len(self._node_ids)
+
+    def values(self, key):
+        return set(self._postings[key])
+
+    def node_ids(self, key, values):
+        """Ids of the nodes whose metadata value for a key is one of `values`"""
+        postings = self._postings[key]
+        return set().union(*(postings.get(value, ()) for value in values))
+
+    def select(self, filters):
+        """Ids of the nodes matching (possibly nested) MetadataFilters
+
+        Raises ValueError when a filter is on a key that is not indexed.
+        """
+        selections = []
+        for metadata_filter in filters.filters:
+            if isinstance(metadata_filter, MetadataFilters):
+                selections.append(self.select(metadata_filter))
+                continue
+            if metadata_filter.key not in self._postings:
+                raise ValueError(f"Metadata key {metadata_filter.key} is not indexed")
+            single = MetadataFilters(filters=[metadata_filter])
+            values = [
+                value for value in self._postings[metadata_filter.key]
+                if metadata_matches({metadata_filter.key: value}, single)
+            ]
+            selections.append(self.node_ids(metadata_filter.key, values))
+
+        if not selections:
+            return set(self._node_ids)
+        if filters.condition == FilterCondition.OR:
+            return set().union(*selections)
+        return set.intersection(*selections)
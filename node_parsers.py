@@ -0,0 +1,160 @@
+import re
+from dataclasses import dataclass, field
+
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.node_parser import NodeParser, SentenceSplitter
+from llama_index.core.node_parser.node_utils import build_nodes_from_splits
+from llama_index.core.schema import MetadataMode
+from llama_index.core.utils import get_tokenizer, get_tqdm_iterable
+
+PIPE_ROW = re.compile(r'^\s*\|.*\|\s*$')
+PIPE_SEPARATOR = re.compile(r'^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$')
+NUMBER_TOKEN = re.compile(r'^[-+(]?\d[\d.,]*%?\)?$|^%$')
+# Label lines the OCR emits right above a run of figures, kept with it as its header
+MAX_CAPTION_LINES = 6
+MAX_CAPTION_WORDS = 15
+
+
+@dataclass
+class Block:
+    """Run of lines of a page, either prose or a table with its header lines"""
+    kind: str  # 'text' or 'table'
+    lines: list
+    header: list = field(default_factory=list)
+    start: int = 0  # Index in the page of the first line of `lines`
+
+
+def is_numeric_row(line):
+    """Whether a line is a row of figures, as the OCR renders QRT tables without separators"""
+    tokens = line.split()
+    numbers = sum(1 for token in tokens if NUMBER_TOKEN.match(token))
+    return numbers >= 3 and numbers >= 0.6 * len(tokens)
+
+
+def is_caption_line(line):
+    """Whether a line looks like a table label rather than a prose sentence"""
+    line = line.strip()
+    return bool(line) and not line.endswith('.') and len(line.split()) <= MAX_CAPTION_WORDS
+
+
+def split_blocks(text):
+    """Split a page into prose blocks and tables, in order
+
+    Tables are runs of `|`-delimited rows, whose first row (and separator)
+    is the header, or runs of numeric rows, whose header is the short label
+    lines just above them.
+    """
+    blocks = []
+    lines = text.splitlines()
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if PIPE_ROW.match(line):
+            end = i
+            while end < len(lines) and PIPE_ROW.match(lines[end]):
+                end += 1
+            rows = lines[i:end]
+            header_size = 2 if len(rows) >= 2 and PIPE_SEPARATOR.match(rows[1]) else 1
+            # A header without rows is no table: its lines are kept as text
+            if len(rows) > header_size:
+                blocks.append(Block('table', rows[header_size:], rows[:header_size], i + header_size))
+                i = end
+                continue
+        elif is_numeric_row(line):
+            end = i
+            while end < len(lines) and is_numeric_row(lines[end]):
+                end += 1
+            caption = []
+            if blocks and blocks[-1].kind == 'text':
+                previous = blocks[-1].lines
+                while previous and len(caption) < MAX_CAPTION_LINES and is_caption_line(previous[-1]):
+                    caption.insert(0, previous.pop())
+                if not previous:
+                    blocks.pop()
+            blocks.append(Block('table', lines[i:end], caption, i))
+            i = end
+            continue
+
+        if not blocks or blocks[-1].kind != 'text':
+            blocks.append(Block('text', [], start=i))
+        blocks[-1].lines.append(line)
+        i += 1
+    return [block for block in blocks if any(line.strip() for line in block.lines)]
+
+
+class TableAwareNodeParser(NodeParser):
+    """Chunk prose with a sentence splitter and keep tables as atomic nodes
+
+    A table that does not fit in a chunk is split into row groups, each one
+    repeating the table header and starting at the offset of its first row. Nodes are tagged with a `node_type`
+    metadata of 'text' or 'table'.
+    """
+
+    chunk_size: int = Field(default=1024, gt=0)
+    chunk_overlap: int = Field(default=200, ge=0)
+
+    _text_splitter: SentenceSplitter = PrivateAttr()
+    _tokenizer = PrivateAttr()
+
+    def __init__(self, chunk_size=1024, chunk_overlap=200, **kwargs):
+        super().__init__(chunk_size=chunk_size, chunk_overlap=chunk_overlap, **kwargs)
+        self._text_splitter = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        self._tokenizer = get_tokenizer()
+
+    @classmethod
+    def class_name(cls):
+        return "TableAwareNodeParser"
+
+    def _token_count(self, text):
+        return len(self._tokenizer(text))
+
+    def _split_table(self, block, budget):
+        """Group table rows under the token budget, as lists of rows"""
+        header = '\n'.join(block.header)
+        budget -= self._token_count(header)
+        groups, rows, size = [], [], 0
+        for row in block.lines:
+            row_size = self._token_count(row)
+            if rows and size + row_size > budget:
+                groups.append(rows)
+                rows, size = [], 0
+            rows.append(row)
+            size += row_size
+        if rows:
+            groups.append(rows)
+        return groups
+
+    def _parse_nodes(self, nodes, show_progress=False, **kwargs):
+        all_nodes = []
+        for node in get_tqdm_iterable(nodes, show_progress, "Parsing nodes"):
+            metadata_str = node.get_metadata_str(mode=MetadataMode.LLM)
+            budget = self.chunk_size - self._token_count(metadata_str)
+            text = node.get_content(metadata_mode=MetadataMode.NONE)
+            line_offsets = [0]
+            for line in text.splitlines(keepends=True):
+                line_offsets.append(line_offsets[-1] + len(line))
+            for block in split_blocks(text):
+                spans = []
+                if block.kind == 'table':
+                    # Every group repeats the header, so its text is not found in the page: it starts at its first row
+                    groups = self._split_table(block, budget)
+                    splits = ['\n'.join(block.header + rows) for rows in groups]
+                    first = block.start
+                    for rows in groups:
+                        last = first + len(rows) - 1
+                        spans.append((line_offsets[first], line_offsets[last] + len(block.lines[last - block.start])))
+                        first = last + 1
+                else:
+                    splits = self._text_splitter.split_text_metadata_aware(
+                        '\n'.join(block.lines), metadata_str=metadata_str
+                    )
+                split_nodes = build_nodes_from_splits(splits, node, id_func=self.id_func)
+                for split_node, (start, end) in zip(split_nodes, spans):
+                    split_node.start_char_idx, split_node.end_char_idx = start, end
+                for split_node in split_nodes:
+                    split_node.metadata["node_type"] = block.kind
+                    split_node.excluded_embed_metadata_keys = [
+                        *node.excluded_embed_metadata_keys, "node_type"
+                    ]
+                    all_nodes.append(split_node)
+        return all_nodes
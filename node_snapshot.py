@@ -0,0 +1,217 @@
+import json
+import mmap
+import os
+import zlib
+from collections import defaultdict
+
+from llama_index.core.schema import NodeRelationship, RelatedNodeInfo, TextNode
+from llama_index.core.storage.docstore.keyval_docstore import KVDocumentStore
+from llama_index.core.storage.docstore.utils import doc_to_json
+from llama_index.core.storage.kvstore.types import DEFAULT_COLLECTION, BaseKVStore
+
+TEXTS_FILE = 'nodes.bin'  # zlib-compressed UTF-8 texts of the nodes, back to back
+NODES_FILE = 'nodes.json'  # Text offsets and spans of the nodes
+# Version 3 no longer stores node ids and metadata, which the vector store of the snapshot holds
+FORMAT_VERSION = 3
+
+
+def pack_metadata(metadata):
+    """Store a list of metadata dicts as one column per key, keys being repeated in most nodes"""
+    keys = sorted({key for values in metadata for key in values})
+    return {
+        "columns": {key: [values.get(key) for values in metadata] for key in keys},
+        # Rows without a key, so they are not given a None value when unpacked
+        "absent": {
+            key: [row for row, values in enumerate(metadata) if key not in values]
+            for key in keys if any(key not in values for values in metadata)
+        },
+    }
+
+
+def unpack_metadata(packed, size):
+    metadata = [{} for _ in range(size)]
+    for key, column in packed["columns"].items():
+        absent = set(packed["absent"].get(key, ()))
+        for row, value in enumerate(column):
+            if row not in absent:
+                metadata[row][key] = value
+    return metadata
+
+
+def write_nodes(directory, nodes):
+    """Write the nodes' compressed texts as one blob, and their offsets as a JSON sidecar
+
+    Nodes are given in the row order of the snapshot's vector store, whose
+    columns hold their ids and metadata.
+    """
+    offsets, excluded_lists, excluded = [0], {}, []
+    with open(os.path.join(directory, TEXTS_FILE), 'wb') as f:
+        for node in nodes:
+            data = zlib.compress(node.text.encode('utf-8'))
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+            # Nodes of a file share a few lists of excluded keys, each stored once
+            lists = (tuple(node.excluded_embed_metadata_keys), tuple(node.excluded_llm_metadata_keys))
+            excluded.append(excluded_lists.setdefault(lists, len(excluded_lists)))
+
+    with open(os.path.join(directory, NODES_FILE), 'w', encoding='utf-8') as f:
+        json.dump({
+            "version": FORMAT_VERSION,
+            "compression": "zlib",
+            "offsets": offsets,
+            "char_spans": [[node.start_char_idx, node.end_char_idx] for node in nodes],
+            "excluded_lists": [[list(embed), list(llm)] for embed, llm in excluded_lists],
+            "excluded": excluded,
+        }, f)
+
+
+class NodeSnapshot:
+    """Nodes written by write_nodes: ids and metadata in memory, texts read from the mapped blob on demand
+
+    `columns` are the ids, source document ids, metadata and rows of the
+    snapshot's vector store, shared rather than copied. Versions 1 and 2
+    stored their own, texts being uncompressed in version 1.
+    """
+
+    def __init__(self, directory, columns=None):
+        with open(os.path.join(directory, NODES_FILE), encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get("version") not in (1, 2, FORMAT_VERSION):
+            raise ValueError(f"Unsupported node snapshot version: {data.get('version')}")
+
+        if "ids" in data:
+            self.ids = data["ids"]
+            self.ref_doc_ids = data["ref_doc_ids"]
+            self.metadata = unpack_metadata(data["metadata"], len(self.ids))
+            self.rows = {node_id: row for row, node_id in enumerate(self.ids)}
+        elif columns is not None:
+            self.ids, self.ref_doc_ids, self.metadata, self.rows = columns
+        else:
+            raise ValueError("Node snapshot without the columns of its vector store")
+        self._offsets = data["offsets"]
+        if len(self._offsets) != len(self.ids) + 1:
+            raise ValueError("Node snapshot out of step with its vector store")
+        self._char_spans = data["char_spans"]
+        self._excluded_lists = data["excluded_lists"]
+        self._excluded = data["excluded"]
+        self._compressed = data.get("compression") == "zlib"
+        self._texts = b''
+        if self._offsets[-1]:
+            with open(os.path.join(directory, TEXTS_FILE), 'rb') as f:
+                # The mapping outlives the file, even once an older snapshot directory is removed
+                self._texts = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def text(self, row):
+        data = self._texts[self._offsets[row]:self._offsets[row + 1]]
+        return (zlib.decompress(data) if self._compressed else data).decode('utf-8')
+
+    def node(self, row):
+        embed_keys, llm_keys = self._excluded_lists[self._excluded[row]]
+        start_char_idx, end_char_idx = self._char_spans[row]
+        ref_doc_id = self.ref_doc_ids[row]
+        return TextNode(
+            id_=self.ids[row],
+            text=self.text(row),
+            metadata=dict(self.metadata[row]),
+            excluded_embed_metadata_keys=list(embed_keys),
+            excluded_llm_metadata_keys=list(llm_keys),
+            start_char_idx=start_char_idx,
+            end_char_idx=end_char_idx,
+            relationships={NodeRelationship.SOURCE: RelatedNodeInfo(node_id=ref_doc_id)} if ref_doc_id else {}
+        )
+
+
+class LazyNodeKVStore(BaseKVStore):
+    """Key-value store behind a KVDocumentStore, serving the nodes of a NodeSnapshot without loading them
+
+    A node is only decompressed and built when the docstore asks for it,
+    typically for the top-k hits of a query. Writes and deletions are kept
+    in memory on top of the snapshot, which is never modified.
+    """
+
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+        self._ref_docs = {}  # ref doc id -> ids of its nodes
+        for node_id, ref_doc_id in zip(snapshot.ids, snapshot.ref_doc_ids):
+            if ref_doc_id:
+                self._ref_docs.setdefault(ref_doc_id, []).append(node_id)
+        self._written = defaultdict(dict)  # collection -> key -> value
+        self._deleted = defaultdict(set)  # collection -> keys deleted from the snapshot
+
+    def _base(self, key, collection):
+        """Value of a key in the snapshot, as KVDocumentStore stores it, or None"""
+        kind = collection.rsplit('/', 1)[-1]
+        if kind == 'data':
+            row = self._snapshot.rows.get(key)
+            return doc_to_json(self._snapshot.node(row)) if row is not None else None
+        if kind == 'metadata':
+            row = self._snapshot.rows.get(key)
+            if row is None:
+                return None
+            values = {"doc_hash": self._snapshot.node(row).hash}
+            if self._snapshot.ref_doc_ids[row]:
+                values["ref_doc_id"] = self._snapshot.ref_doc_ids[row]
+            return values
+        if kind == 'ref_doc_info' and key in self._ref_docs:
+            node_ids = self._ref_docs[key]
+            # Like KVDocumentStore, the metadata of a source document is that of its first node
+            return {"node_ids": list(node_ids), "metadata": dict(self._snapshot.metadata[self._snapshot.rows[node_ids[0]]])}
+        return None
+
+    def _base_keys(self, collection):
+        kind = collection.rsplit('/', 1)[-1]
+        if kind in ('data', 'metadata'):
+            return self._snapshot.ids
+        if kind == 'ref_doc_info':
+            return list(self._ref_docs)
+        return []
+
+    def put(self, key, val, collection=DEFAULT_COLLECTION):
+        self._written[collection][key] = dict(val)
+        self._deleted[collection].discard(key)
+
+    async def aput(self, key, val, collection=DEFAULT_COLLECTION):
+        self.put(key, val, collection)
+
+    def get(self, key, collection=DEFAULT_COLLECTION):
+        if key in self._written[collection]:
+            return dict(self._written[collection][key])
+        if key in self._deleted[collection]:
+            return None
+        return self._base(key, collection)
+
+    async def aget(self, key, collection=DEFAULT_COLLECTION):
+        return self.get(key, collection)
+
+    def get_all(self, collection=DEFAULT_COLLECTION):
+        """Every value of a collection; this builds all the nodes, so it is kept off the query path"""
+        values = {
+            key: self._base(key, collection) for key in self._base_keys(collection)
+            if key not in self._deleted[collection] and key not in self._written[collection]
+        }
+        values.update({key: dict(val) for key, val in self._written[collection].items()})
+        return values
+
+    async def aget_all(self, collection=DEFAULT_COLLECTION):
+        return self.get_all(collection)
+
+    def delete(self, key, collection=DEFAULT_COLLECTION):
+        if self.get(key, collection) is None:
+            return False
+        self._written[collection].pop(key, None)
+        self._deleted[collection].add(key)
+        return True
+
+    async def adelete(self, key, collection=DEFAULT_COLLECTION):
+        return self.delete(key, collection)
+
+
+class LazyDocumentStore(KVDocumentStore):
+    """Docstore of a NodeSnapshot: only node ids and metadata stay resident, texts are fetched on demand"""
+
+    def __init__(self, snapshot):
+        super().__init__(LazyNodeKVStore(snapshot))
+        self.snapshot = snapshot
\ No newline at end of file
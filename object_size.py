@@ -0,0 +1,36 @@
+import logging
+import sys
+import types
+
+import numpy as np
+
+# Objects referenced by the structures of a shard that it does not own
+SHARED_TYPES = (type, types.ModuleType, types.FunctionType, types.MethodType, logging.Logger)
+
+
+def object_bytes(*objects, exclude=()):
+    """Approximate memory held by some objects and everything they reference, each object counted once
+
+    NumPy arrays count their buffer, except memory-mapped ones whose pages
+    belong to the OS page cache. Objects in `exclude`, and what only they
+    reference, are not counted.
+    """
+    seen = {id(obj) for obj in exclude}
+    stack, size = list(objects), 0
+    while stack:
+        obj = stack.pop()
+        if obj is None or id(obj) in seen or isinstance(obj, SHARED_TYPES):
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, np.ndarray):
+            size += 0 if isinstance(obj, np.memmap) else obj.nbytes
+            continue
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif hasattr(obj, '__dict__') and not isinstance(obj, (str, bytes, int, float)):
+            stack.append(vars(obj))
+    return size
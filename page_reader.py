@@ -0,0 +1,86 @@
+import hashlib
+import os
+import re
+from collections import Counter
+from functools import lru_cache
+
+from llama_index.core import Document
+from llama_index.core.readers.base import BaseReader
+
+PAGE_MARKER = re.compile(r'^=+\s*page\s+(\d+)\s*=+$', re.IGNORECASE)
+COMPANY_PATTERN = re.compile(r'^predicted_([a-z]+)', re.IGNORECASE)
+CLOSING_DATE_PATTERN = re.compile(r'31 d[ée]cembre (20\d\d)', re.IGNORECASE)
+
+
+def company_from_filename(file_name):
+    """Parse the company name from an OCR output name such as predicted_axa-output-1-to-71.txt"""
+    match = COMPANY_PATTERN.match(os.path.basename(file_name))
+    return match.group(1).lower() if match else os.path.splitext(os.path.basename(file_name))[0]
+
+
+@lru_cache(maxsize=1024)
+def _content_digest(path, size, mtime_ns):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_digest(file_path):
+    """Hash a file's content, re-reading it only when its size or modification time changed"""
+    stat = os.stat(file_path)
+    return _content_digest(os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+
+
+def iter_pages(file_path):
+    """Stream (page number, text) pairs from an OCR output file, one page in memory at a time"""
+    page, lines = 0, []
+    with open(file_path, encoding='utf-8') as f:
+        for line in f:
+            match = PAGE_MARKER.match(line.strip())
+            if match is None:
+                lines.append(line)
+                continue
+
+            text = ''.join(lines).strip()
+            if text:
+                yield page, text
+            page, lines = int(match.group(1)), []
+
+    text = ''.join(lines).strip()
+    if text:
+        yield page, text
+
+
+def report_year(file_path, pages=10):
+    """Financial year of a report: the closing date its first pages mention most, or None"""
+    years = Counter()
+    for page, (_, text) in enumerate(iter_pages(file_path)):
+        if page >= pages:
+            break
+        years.update(CLOSING_DATE_PATTERN.findall(text))
+    return int(years.most_common(1)[0][0]) if years else None
+
+
+class SFCRPageReader(BaseReader):
+    """Read SFCR OCR outputs as one document per `=======page N=======` section"""
+
+    def lazy_load_data(self, file_path):
+        """Yield one document per non-empty page with file, company, year and page metadata"""
+        file_name = os.path.basename(file_path)
+        company = company_from_filename(file_name)
+        year = report_year(file_path)
+        for page, text in iter_pages(file_path):
+            metadata = {"file": file_name, "company": company, "year": year, "page": page}
+            yield Document(
+                id_=f"{file_name}#page-{page}",
+                text=text,
+                metadata=metadata,
+                # Keep chunk text identical across files so embeddings can be shared
+                excluded_embed_metadata_keys=list(metadata)
+            )
+
+    def load_data(self, file_path):
+        """Load every page of a file"""
+        return list(self.lazy_load_data(file_path))
@@ -1,40 +1,65 @@
+import hashlib
+import json
 import logging
 import sys
 import os
 import time
 import streamlit as st
-from dataclasses import dataclass
 
 import google.generativeai as genai
-from llama_index.core import Settings, VectorStoreIndex, SimpleDirectoryReader
+from llama_index.core import Settings
+from llama_index.core.agent import AgentRunner
+from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.tools import QueryEngineTool
+from llama_index.core.vector_stores import FilterOperator, MetadataFilter, MetadataFilters
 from llama_index.llms.gemini import Gemini
 from llama_index.embeddings.gemini import GeminiEmbedding
 
-@dataclass
-class AppConfig:
-    """Configuration class for application settings"""
-    CHUNK_SIZE: int = 512
-    CHUNK_OVERLAP: int = 50
-    TOP_K_RESULTS: int = 5
-    MAX_TOKENS: int = 1024
-    DEFAULT_TEMPERATURE: float = 0.3
-    LOG_FILE: str = 'app.log'
-    EVAL_TEMPERATURE: float = 0.2  # Lower temperature for more consistent evaluations
-
-    # Latest Gemini Models
-    GEMINI_MODELS = {
-        "Gemini 1.5 Pro": "gemini-1.5-pro-latest",
-        "Gemini 2.0 Flash": "gemini-2.0-flash-exp"
-    }
-
-    # Evaluation criteria
-    EVALUATION_CRITERIA = [
-        "Relevance to the original query",
-        "Accuracy of information",
-        "Clarity and coherence",
-        "Comprehensiveness",
-        "Use of context from provided documents"
-    ]
+from config import AppConfig, indexing_config
+from embedding_cache import CachedEmbedding, EmbeddingCache
+from embedding_pipeline import AdaptiveEmbeddingPipeline
+from index_store import IndexBuild, IndexStore
+from job_queue import JobQueue
+from key_figures import METRICS, metrics_in
+from page_reader import company_from_filename, file_digest
+from retrievers import YEAR_PATTERN, ShardedRetriever, question_words
+from sections import CHAPTERS
+from table_store import TableStore
+
+@st.cache_resource
+def get_embedding_cache():
+    """Embedding cache shared by every session of this process"""
+    return EmbeddingCache(AppConfig.EMBEDDING_CACHE_PATH, AppConfig.EMBEDDING_CACHE_MAX_ENTRIES)
+
+@st.cache_resource
+def get_embedding_pipeline():
+    """Adaptive embedding pipeline whose learned batch size and parallelism outlive reruns"""
+    return AdaptiveEmbeddingPipeline(
+        batch_size=AppConfig.EMBED_BATCH_SIZE,
+        max_batch_size=AppConfig.EMBED_MAX_BATCH_SIZE,
+        concurrency=AppConfig.EMBED_CONCURRENCY,
+        max_concurrency=AppConfig.EMBED_MAX_CONCURRENCY,
+        target_latency=AppConfig.EMBED_TARGET_LATENCY
+    )
+
+@st.cache_resource
+def get_index_store():
+    """Index shards shared read-only by every session, so a report is loaded and embedded once per process"""
+    return IndexStore(**indexing_config()["index"], memory_budget=AppConfig.INDEX_MEMORY_BUDGET)
+
+@st.cache_resource
+def get_job_queue():
+    """Queue of the index builds run by indexing_worker.py processes"""
+    return JobQueue(AppConfig.JOB_SPOOL_DIR)
+
+@st.cache_resource
+def get_table_store():
+    """Store of the tables extracted from the OCR files, shared by every session"""
+    return TableStore(AppConfig.TABLE_STORE_PATH)
+
+def fingerprint(*inputs):
+    """Hash the inputs of a stage, so a rerun can tell whether they changed"""
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
 
 class DocumentChatApp:
     def __init__(self):
@@ -43,7 +68,8 @@ class DocumentChatApp:
         self._validate_api_key()
         self._initialize_genai()
         
-        self.documents = []  # Initialize documents list
+        self.documents = []  # Nodes retrieved for the last answer, used as evaluation context
+        self.answered_from_tables = False  # Whether the last SQL mode answer came from the table store
         self.eval_model = None  # Evaluation model
 
     def _setup_logging(self):
@@ -81,9 +107,15 @@ class DocumentChatApp:
                 max_tokens=AppConfig.MAX_TOKENS
             )
             
-            self.embed_model = GeminiEmbedding(
-                api_key=self.GOOGLE_API_KEY,
-                model_name="models/embedding-001"
+            self.embed_model = CachedEmbedding(
+                GeminiEmbedding(
+                    api_key=self.GOOGLE_API_KEY,
+                    model_name=AppConfig.EMBEDDING_MODEL,
+                    embed_batch_size=AppConfig.EMBED_MAX_BATCH_SIZE
+                ),
+                get_embedding_cache(),
+                pipeline=get_embedding_pipeline(),
+                embed_batch_size=AppConfig.EMBED_INPUT_BATCH_SIZE
             )
             
             # Initialize evaluation model
@@ -93,6 +125,8 @@ class DocumentChatApp:
                 temperature=AppConfig.EVAL_TEMPERATURE,
                 max_tokens=AppConfig.MAX_TOKENS
             )
+            # Kept across reruns, so the models are only rebuilt when their settings change
+            st.session_state.models = (self.llm, self.embed_model, self.eval_model)
         except Exception as e:
             self.logger.error(f"Model initialization error: {e}")
             st.error(f"Failed to initialize models: {e}")
@@ -133,47 +167,121 @@ class DocumentChatApp:
             self.logger.error(f"Response evaluation error: {e}")
             return f"Evaluation failed: {e}"
 
-    def _load_local_documents(self, selected_files):
-        """Load documents directly from the txt_files directory based on user selection."""
-        self.documents = []
-        txt_dir = "txt_files"
-        if not os.path.exists(txt_dir):
-            st.error("Text directory not found. Please ensure txt_files directory is present.")
-            return []
-        
-        input_files = [os.path.join(txt_dir, f) for f in selected_files]
-
+    def _start_index_build(self, selected_files, index_inputs):
+        """Sync the selected files' shards on a background thread, cancelling the build of a previous selection"""
         try:
-            reader = SimpleDirectoryReader(input_files=input_files)
-            self.documents = reader.load_data()
-
-            if not self.documents:
-                st.warning("No documents were loaded. Please check the selected files.")
-            
-            return self.documents
+            previous = st.session_state.index_build
+            if previous is not None and not previous.done:
+                previous.cancel()
+
+            summarize = None
+            if AppConfig.SUMMARY_TREE:
+                llm = self.llm
+                summarize = lambda prompt: str(llm.complete(prompt))
+            st.session_state.index_build = IndexBuild(
+                get_index_store(),
+                [os.path.join("txt_files", f) for f in selected_files],
+                embed_model=self.embed_model,
+                summarize=summarize,
+                summary_concurrency=AppConfig.SUMMARY_CONCURRENCY,
+                queue=get_job_queue() if AppConfig.INDEXING_WORKER else None,
+                job_config=indexing_config()
+            ).start()
+            st.session_state.index_build_inputs = index_inputs
         except Exception as e:
-            self.logger.error(f"Document loading error: {e}")
-            st.error(f"Failed to load documents: {e}")
-            return []
+            self.logger.error(f"Vector index creation error: {e}")
+            st.error(f"Failed to create vector index: {e}")
+            return False
 
-    def _create_vector_index(self):
-        """Create vector index from loaded documents"""
+    def _collect_index_build(self):
+        """Swap in the shards of a finished background build; the chat keeps the previous ones until then"""
+        build = st.session_state.index_build
+        if build is None or not build.done:
+            return
+        st.session_state.index_build = None
+        if build.cancelled:
+            return
+        if build.shards is None:
+            st.error(f"Failed to create vector index: {build.error}")
+            # Retried on the next rerun
+            st.session_state.stage_inputs.pop("index", None)
+            return
+
+        st.session_state.index_shards = build.shards
+        # The previous shards can be evicted once no session leases them
+        if st.session_state.shard_lease is not None:
+            st.session_state.shard_lease.release()
+        st.session_state.shard_lease = build.lease
+        st.session_state.index_inputs = st.session_state.index_build_inputs
+        for report in build.reports:
+            if report.nodes_embedded:
+                st.sidebar.info(
+                    f"{report.file}: {report.pages_changed} pages re-indexed, "
+                    f"{report.embeddings_saved} embeddings reused"
+                )
+
+    @st.experimental_fragment(run_every=1)
+    def _show_build_progress(self):
+        """Progress of the background index build, refreshed every second until it is done"""
+        build = st.session_state.index_build
+        if build is None:
+            return
+        if build.done:
+            # Rerun the whole script so the new shards are swapped in
+            st.rerun()
+        progress = build.progress
+        st.progress(
+            progress.files_done / max(progress.files_total, 1),
+            text=f"Indexing {progress.current_file}: {progress.files_done}/{progress.files_total} files, "
+                 f"{progress.chunks_embedded}/{progress.chunks_total} chunks embedded"
+        )
+
+    def _show_index_stats(self):
+        """Sidebar caption of the embedding cache and shared index memory"""
+        cache_stats = get_embedding_cache().stats()
+        memory_stats = get_index_store().memory_stats()
+        st.sidebar.caption(
+            f"Embedding cache: {cache_stats['hit_rate']:.0%} hit rate, "
+            f"{cache_stats['entries']} vectors stored. "
+            f"Shared indexes: {memory_stats['shards']} shards, "
+            f"{memory_stats['bytes'] / 1024 ** 2:.0f} MB in memory"
+        )
+
+    def _load_tables(self, selected_files):
+        """Extract the tables of the selected files into the table store when they changed"""
         try:
-            return VectorStoreIndex.from_documents(
-                self.documents, 
-                chunk_size=AppConfig.CHUNK_SIZE, 
-                chunk_overlap=AppConfig.CHUNK_OVERLAP
-            )
+            for f in selected_files:
+                get_table_store().sync_file(os.path.join("txt_files", f))
         except Exception as e:
-            self.logger.error(f"Vector index creation error: {e}")
-            st.error(f"Failed to create vector index: {e}")
-            return None
+            self.logger.error(f"Table extraction error: {e}")
+            st.error(f"Failed to extract tables: {e}")
+            return False
 
-    def _initialize_chat_engine(self, vector_index):
-        """Initialize chat engine with vector index"""
+    def _initialize_chat_engine(self, index_shards):
+        """Initialize chat engine retrieving across the index shards"""
         try:
-            return vector_index.as_chat_engine(
-                similarity_top_k=AppConfig.TOP_K_RESULTS
+            filters = None
+            if st.session_state.chapter_filter:
+                filters = MetadataFilters(filters=[MetadataFilter(
+                    key="chapter", value=st.session_state.chapter_filter, operator=FilterOperator.IN
+                )])
+            retriever = ShardedRetriever(
+                index_shards,
+                similarity_top_k=AppConfig.TOP_K_RESULTS,
+                filters=filters,
+                hybrid=AppConfig.HYBRID_RETRIEVAL,
+                candidate_factor=AppConfig.FUSION_CANDIDATE_FACTOR,
+                rrf_k=AppConfig.RRF_K,
+                section_routing=AppConfig.SECTION_ROUTING,
+                coarse_to_fine=AppConfig.SUMMARY_TREE,
+                summary_top_sections=AppConfig.SUMMARY_TOP_SECTIONS,
+                summary_top_pages=AppConfig.SUMMARY_TOP_PAGES,
+                max_workers=AppConfig.RETRIEVAL_WORKERS
+            )
+            query_engine = RetrieverQueryEngine.from_args(retriever, llm=self.llm)
+            return AgentRunner.from_llm(
+                tools=[QueryEngineTool.from_defaults(query_engine=query_engine)],
+                llm=self.llm
             )
         except Exception as e:
             self.logger.error(f"Chat engine initialization error: {e}")
@@ -210,7 +318,11 @@ class DocumentChatApp:
             step=0.1
         )
         
-        st.sidebar.write("Select between 1 and 4 documents from the image:")
+        st.session_state.query_mode = st.sidebar.selectbox(
+            'Query mode',
+            AppConfig.QUERY_MODES,
+            help="Tables (SQL) answers numeric lookups from the extracted tables, without the LLM"
+        )
 
         txt_dir = "txt_files"
         if os.path.exists(txt_dir):
@@ -221,7 +333,14 @@ class DocumentChatApp:
         st.session_state.selected_files = st.sidebar.multiselect(
             "Select documents",
             options=available_files,
-            help="Select between 1 and 4 documents."
+            help="Each report is indexed once and kept on disk; questions naming an insurer only search its report."
+        )
+
+        st.session_state.chapter_filter = st.sidebar.multiselect(
+            "Restrict to report chapters",
+            options=list(CHAPTERS),
+            format_func=lambda letter: f"{letter}. {CHAPTERS[letter]}",
+            help="Only search these chapters of the regulatory outline"
         )
 
         # Add toggle for response evaluation
@@ -235,7 +354,8 @@ class DocumentChatApp:
         if st.sidebar.button('Clear Conversation'):
             st.session_state.messages = []
             st.session_state.conversation_context = None
-            st.session_state.vector_index = None
+            # Rebuild the chat engine, and with it the agent's memory of the conversation
+            st.session_state.get("stage_inputs", {}).pop("chat_engine", None)
 
     def _initialize_session_state(self):
         """Initialize or reset session state variables"""
@@ -243,8 +363,19 @@ class DocumentChatApp:
             st.session_state.messages = []
         if "conversation_context" not in st.session_state:
             st.session_state.conversation_context = None
-        if "vector_index" not in st.session_state:
-            st.session_state.vector_index = None
+        if "index_shards" not in st.session_state:
+            st.session_state.index_shards = None
+        if "stage_inputs" not in st.session_state:
+            st.session_state.stage_inputs = {}  # Stage -> fingerprint of the inputs it last ran with
+        if "stage_timings" not in st.session_state:
+            st.session_state.stage_timings = {}  # Stage -> seconds it took on this rerun, None when skipped
+        if "shard_lease" not in st.session_state:
+            st.session_state.shard_lease = None
+        if "index_build" not in st.session_state:
+            st.session_state.index_build = None  # Background build of the selected files' shards
+            st.session_state.index_build_inputs = None
+        if "index_inputs" not in st.session_state:
+            st.session_state.index_inputs = None  # Fingerprint of the inputs of index_shards
         if "selected_model" not in st.session_state:
             st.session_state.selected_model = "Gemini Pro"
         if "temperature" not in st.session_state:
@@ -253,41 +384,99 @@ class DocumentChatApp:
             st.session_state.selected_files = []
         if "enable_evaluation" not in st.session_state:
             st.session_state.enable_evaluation = True
+        if "chapter_filter" not in st.session_state:
+            st.session_state.chapter_filter = []
+        if "query_mode" not in st.session_state:
+            st.session_state.query_mode = AppConfig.QUERY_MODES[0]
 
     def _process_local_documents(self):
         """Process local documents based on user selection and create vector index"""
         selected_files = st.session_state.selected_files
-        
-        # Vérifier le nombre de fichiers sélectionnés
-        if selected_files:
-            if len(selected_files) > 4:
-                st.warning("You selected more than 4 documents. Only the first 4 will be considered.")
-                selected_files = selected_files[:4]
-        else:
+        if not selected_files:
+            if st.session_state.index_build is not None:
+                st.session_state.index_build.cancel()
+                st.session_state.index_build = None
+                # Selecting the same files again must start a new build, not find the stage up to date
+                st.session_state.stage_inputs.pop("index", None)
+                st.session_state.index_build_inputs = None
             st.info("Please select at least one document.")
             return
-        
-        documents = self._load_local_documents(selected_files)
-        
-        if documents:
-            # Initialize models
-            self._initialize_models(st.session_state.selected_model)
-            
-            # Configure settings
-            Settings.llm = self.llm
-            Settings.embed_model = self.embed_model
-            Settings.chunk_size = AppConfig.CHUNK_SIZE
-            Settings.chunk_overlap = AppConfig.CHUNK_OVERLAP
-            
-            # Create vector index
-            st.session_state.vector_index = self._create_vector_index()
-            
-            # Initialize chat engine
-            if st.session_state.vector_index:
-                st.session_state.chat_engine = self._initialize_chat_engine(st.session_state.vector_index)
-                st.sidebar.success(f"{len(documents)} documents loaded successfully!")
-        else:
+        if not os.path.exists("txt_files"):
+            st.error("Text directory not found. Please ensure txt_files directory is present.")
+            return
+
+        # Each stage only runs when its inputs changed since the previous rerun
+        st.session_state.stage_timings = {}
+        model_inputs = fingerprint(st.session_state.selected_model, st.session_state.temperature)
+        self._run_stage(
+            "models", model_inputs, lambda: self._initialize_models(st.session_state.selected_model)
+        )
+        self.llm, self.embed_model, self.eval_model = st.session_state.models
+
+        # Configure settings
+        Settings.llm = self.llm
+        Settings.embed_model = self.embed_model
+        Settings.chunk_size = AppConfig.CHUNK_SIZE
+        Settings.chunk_overlap = AppConfig.CHUNK_OVERLAP
+
+        # File digests are memoized by size and modification time, so a changed file is noticed cheaply
+        file_paths = [os.path.join("txt_files", f) for f in selected_files]
+        file_inputs = [(f, file_digest(path)) for f, path in zip(selected_files, file_paths)]
+        index_inputs = fingerprint(
+            file_inputs, AppConfig.CHUNK_SIZE, AppConfig.CHUNK_OVERLAP, AppConfig.EMBEDDING_MODEL,
+            AppConfig.VECTOR_STORE, AppConfig.SUMMARY_TREE
+        )
+
+        # Load, update or create one index shard per selected file in the background
+        self._run_stage("index", index_inputs, lambda: self._start_index_build(selected_files, index_inputs))
+        # Never waited for: the progress fragment reruns the script once the build is done
+        self._collect_index_build()
+        if st.session_state.index_build is not None:
+            with st.sidebar:
+                self._show_build_progress()
+        self._run_stage("tables", fingerprint(file_inputs), lambda: self._load_tables(selected_files))
+
+        if st.session_state.index_shards:
+            def build_chat_engine():
+                st.session_state.chat_engine = self._initialize_chat_engine(st.session_state.index_shards)
+                return st.session_state.chat_engine is not None
+
+            self._run_stage(
+                "chat_engine",
+                fingerprint(model_inputs, st.session_state.index_inputs, st.session_state.chapter_filter),
+                build_chat_engine
+            )
+            index_shards = st.session_state.index_shards
+            pages = sum(len(shard.metadata.values("page")) for shard in index_shards)
+            st.sidebar.success(f"{len(index_shards)} documents ({pages} pages) loaded successfully!")
+            self._show_index_stats()
+        elif st.session_state.index_build is None:
             st.sidebar.error("Failed to load the selected documents. Please try again.")
+        self._show_stage_timings()
+
+    def _run_stage(self, name, inputs, action):
+        """Run an expensive stage only when the fingerprint of its inputs changed
+
+        The fingerprint is only recorded when the action does not return False,
+        so a failed stage is retried on the next rerun.
+        """
+        if st.session_state.stage_inputs.get(name) == inputs:
+            st.session_state.stage_timings[name] = None
+            return
+        start = time.perf_counter()
+        if action() is not False:
+            st.session_state.stage_inputs[name] = inputs
+        else:
+            st.session_state.stage_inputs.pop(name, None)
+        st.session_state.stage_timings[name] = time.perf_counter() - start
+
+    def _show_stage_timings(self):
+        """Sidebar indicator of the stages that ran on this rerun and how long they took"""
+        stages = [
+            f"{name}: {seconds:.2f} s" if seconds is not None else f"{name}: cached"
+            for name, seconds in st.session_state.stage_timings.items()
+        ]
+        st.sidebar.caption("Stages this rerun: " + ", ".join(stages))
 
     def _display_chat_history(self):
         """Display previous chat messages"""
@@ -316,16 +505,26 @@ class DocumentChatApp:
                 st.markdown(prompt)
             
             # Generate and display assistant response
+            sql_mode = st.session_state.query_mode == "Tables (SQL)"
+            key_figure_answer = None if sql_mode else self._key_figure_answer(prompt)
             with st.chat_message("assistant"):
                 response_placeholder = st.empty()
                 full_response = ""
-                for word in self._response_generator(prompt):
+                if sql_mode:
+                    generator = self._table_response_generator(prompt)
+                elif key_figure_answer:
+                    generator = iter([key_figure_answer])
+                else:
+                    generator = self._response_generator(prompt)
+                for word in generator:
                     full_response += word
                     response_placeholder.markdown(full_response)
                 
                 # Perform response evaluation if enabled
                 evaluation = ""
-                if st.session_state.enable_evaluation and self.eval_model:
+                # Answers from the documents are evaluated, even when a table lookup fell back to them
+                fast_path = (sql_mode and self.answered_from_tables) or key_figure_answer is not None
+                if st.session_state.enable_evaluation and self.eval_model and not fast_path:
                     with st.spinner("Evaluating response..."):
                         evaluation = self._evaluate_response(
                             prompt, 
@@ -340,11 +539,41 @@ class DocumentChatApp:
                 "evaluation": evaluation if st.session_state.enable_evaluation else None
             })
 
+    def _key_figure_answer(self, prompt):
+        """Answer a key-figure lookup from the shards' key-figure indexes, or None to use the LLM"""
+        try:
+            metrics = metrics_in(prompt)
+            shards = st.session_state.index_shards or []
+            if not metrics or not shards:
+                return None
+
+            # Only the companies the question names, or every selected document
+            words = question_words(prompt)
+            named = [shard for shard in shards if company_from_filename(shard.file) in words]
+            years = {int(year) for year in YEAR_PATTERN.findall(prompt)}
+            lines = []
+            for shard in named or shards:
+                if years and not years & shard.metadata.values("year"):
+                    return None  # Another year than the report's, which the LLM may find in its comparisons
+                for metric in metrics:
+                    figure = shard.key_figures.get(metric)
+                    if figure is None:
+                        return None
+                    lines.append(
+                        f"- **{company_from_filename(shard.file).upper()}** {METRICS[metric][0]}: "
+                        f"{figure.text} (source: {shard.file}, page {figure.page})"
+                    )
+            return "\n".join(lines)
+        except Exception as e:
+            self.logger.error(f"Key figure lookup error: {e}")
+            return None
+
     def _response_generator(self, prompt):
         """Generate streaming response for the given prompt"""
         try:
-            # Query chat engine
-            response = st.session_state.chat_engine.query(prompt)
+            # Chat, not query: an agent's query starts from an empty history and wipes its memory
+            response = st.session_state.chat_engine.chat(prompt)
+            self.documents = [source.node for source in getattr(response, "source_nodes", [])]
             
             # Check for empty response
             if not response or not str(response).strip():
@@ -360,6 +589,30 @@ class DocumentChatApp:
             self.logger.error(f"Response generation error: {e}")
             yield f"An error occurred: {e}"
 
+    def _table_response_generator(self, prompt):
+        """Answer a numeric lookup with the matching table rows of the selected files, or from the documents"""
+        self.answered_from_tables = True
+        try:
+            rows = get_table_store().lookup(
+                prompt,
+                files=st.session_state.selected_files,
+                limit=AppConfig.TABLE_RESULTS_LIMIT
+            )
+            if not rows:
+                # Most figures of the OCR reports are only stated in prose
+                yield "_No table row of the selected documents matches this question, answering from the documents._\n\n"
+                self.answered_from_tables = False
+                yield from self._response_generator(prompt)
+                return
+
+            yield "| Company | Page | Table | Row | Figures |\n|---|---|---|---|---|\n"
+            for row in rows:
+                label = f"{row['label']} ({row['column']})" if row['column'] else row['label']
+                yield f"| {row['company']} | {row['page']} | {row['caption']} | {label} | {row['raw']} |\n"
+        except Exception as e:
+            self.logger.error(f"Table lookup error: {e}")
+            yield f"An error occurred: {e}"
+
 def main():
     """Main application entry point"""
     try:
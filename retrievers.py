@@ -0,0 +1,225 @@
+import re
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from llama_index.core import Settings
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from french_analyzer import FrenchAnalyzer, fold_accents
+from page_reader import company_from_filename
+
+YEAR_PATTERN = re.compile(r'\b(20\d\d)\b')
+
+
+def question_words(text):
+    """Folded words of a question, so that "relaxation" does not name AXA"""
+    return set(re.findall(r'[a-z]+', fold_accents(text)))
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse ranked lists of node ids into (node id, score) pairs, best first"""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, node_id in enumerate(ranking):
+            scores[node_id] += 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class ShardedRetriever(BaseRetriever):
+    """Retrieve across per-file index shards, fusing vector and BM25 rankings
+
+    Candidates are pre-filtered with each shard's metadata index: by the
+    `filters` given (MetadataFilters on company, year, chapter, section or
+    page), and by the companies and report years the question names, so a
+    question about AXA never scores another insurer's chunks.
+
+    In hybrid mode the vector and lexical searches each return
+    `similarity_top_k * candidate_factor` candidates, which are merged with
+    reciprocal rank fusion and cut back to `similarity_top_k`. With section
+    routing, a question naming a topic of the report outline (SCR, market
+    risk, ...) is only searched in the matching sections of each shard.
+    With coarse-to-fine search, shards with a summary tree are first searched
+    by section then page summary, and only the chunks of the best pages left
+    by the pre-filters and routing are scored; the best section summary is
+    returned with the chunks.
+    Shards are searched in parallel by up to `max_workers` threads, so
+    latency stays flat as more reports are selected.
+    Results are cached by normalized query, so accent, case and spacing
+    variants of a question share one search.
+    """
+
+    def __init__(self, shards, similarity_top_k, filters=None, hybrid=True, candidate_factor=4, rrf_k=60,
+                 section_routing=True, coarse_to_fine=False, summary_top_sections=3, summary_top_pages=6,
+                 max_workers=8, cache_size=128):
+        self._shards = shards
+        self._similarity_top_k = similarity_top_k
+        self._filters = filters
+        self._hybrid = hybrid
+        self._candidate_k = similarity_top_k * candidate_factor if hybrid else similarity_top_k
+        self._rrf_k = rrf_k
+        self._section_routing = section_routing
+        self._coarse_to_fine = coarse_to_fine
+        self._summary_top_sections = summary_top_sections
+        self._summary_top_pages = summary_top_pages
+        self._max_workers = max_workers
+        self._analyzer = FrenchAnalyzer()
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._retrievers = [
+            shard.index.as_retriever(similarity_top_k=self._candidate_k) for shard in shards
+        ]
+        super().__init__()
+
+    def _question_scope(self, query_str):
+        """Companies and report years named in a question, among those of the shards"""
+        words = question_words(query_str)
+        companies = {company_from_filename(shard.file) for shard in self._shards} & words
+        years = {int(year) for year in YEAR_PATTERN.findall(query_str)}
+        years &= set().union(*(shard.metadata.values("year") for shard in self._shards))
+        return companies, years
+
+    def _candidate_node_ids(self, query_str):
+        """Per shard, the ids of the nodes left by the pre-filters, or None to search all of them"""
+        companies, years = self._question_scope(query_str)
+        candidates = []
+        for shard in self._shards:
+            if companies and company_from_filename(shard.file) not in companies:
+                candidates.append(set())
+                continue
+
+            node_ids = shard.metadata.select(self._filters) if self._filters is not None else None
+            if years:
+                year_ids = shard.metadata.node_ids("year", years)
+                node_ids = year_ids if node_ids is None else node_ids & year_ids
+            if self._section_routing:
+                section_ids = shard.sections.route(query_str)
+                if section_ids:
+                    routed = shard.metadata.node_ids("section", section_ids)
+                    if node_ids is not None:
+                        routed &= node_ids
+                    # Too narrow a route would return fewer nodes than asked, keep the wider set instead
+                    if len(routed) >= self._candidate_k:
+                        node_ids = routed
+            candidates.append(node_ids)
+        return candidates
+
+    @staticmethod
+    def _embed_query(query_bundle):
+        if query_bundle.embedding is None and query_bundle.embedding_strs:
+            query_bundle.embedding = Settings.embed_model.get_agg_embedding_from_queries(
+                query_bundle.embedding_strs
+            )
+
+    def _summary_search(self, query_bundle, routed):
+        """Narrow shards to the chunks of their best summarized pages, within the pre-filtered nodes
+
+        Returns the new per-shard node ids and the best section summary as a node, or None.
+        """
+        self._embed_query(query_bundle)
+        narrowed, best = [], None
+        for shard, node_ids in zip(self._shards, routed):
+            if (node_ids is None or node_ids) and shard.summaries is not None and shard.summaries.sections:
+                sections, pages = shard.summaries.search(
+                    query_bundle.embedding, self._summary_top_sections, self._summary_top_pages
+                )
+                candidates = shard.metadata.node_ids("page", pages)
+                if node_ids is not None:
+                    candidates &= node_ids
+                if len(candidates) >= self._candidate_k:
+                    node_ids = candidates
+                # A summary of pages the pre-filters exclude would answer another question
+                if sections and candidates and (best is None or sections[0][1] > best.score):
+                    section, score = sections[0]
+                    best = NodeWithScore(node=TextNode(
+                        id_=f"{shard.file}#summary-{section.id}",
+                        text=f"Summary of section {section.id} {section.title}: {section.summary}",
+                        metadata={"file": shard.file, "section": section.id}
+                    ), score=score)
+            narrowed.append(node_ids)
+        return narrowed, best
+
+    def _vector_search(self, query_bundle, routed):
+        """Embed the query once, search every shard in parallel and keep the best scored nodes"""
+        self._embed_query(query_bundle)
+
+        def search(shard, retriever, node_ids):
+            if node_ids is not None:
+                retriever = shard.index.as_retriever(
+                    similarity_top_k=self._candidate_k, node_ids=list(node_ids)
+                )
+            return retriever.retrieve(query_bundle)
+
+        searches = [
+            (shard, retriever, node_ids)
+            for shard, retriever, node_ids in zip(self._shards, self._retrievers, routed)
+            if node_ids is None or node_ids
+        ]
+        results = []
+        if len(searches) == 1:
+            results.extend(search(*searches[0]))
+        elif searches:
+            with ThreadPoolExecutor(max_workers=min(self._max_workers, len(searches))) as executor:
+                for hits in executor.map(lambda args: search(*args), searches):
+                    results.extend(hits)
+
+        results.sort(key=lambda node: node.score or 0.0, reverse=True)
+        return results[:self._candidate_k]
+
+    def _lexical_search(self, query_str, routed):
+        """BM25 search over every shard, as (shard, node id) pairs, best first"""
+        hits = []
+        for shard, node_ids in zip(self._shards, routed):
+            if node_ids is not None and not node_ids:
+                continue
+            hits.extend(
+                (score, shard, node_id)
+                for node_id, score in shard.lexical.search(query_str, self._candidate_k, node_ids)
+            )
+        hits.sort(key=lambda hit: hit[0], reverse=True)
+        return [(shard, node_id) for _, shard, node_id in hits[:self._candidate_k]]
+
+    def _retrieve(self, query_bundle):
+        key = self._analyzer.cache_key(query_bundle.query_str)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return list(self._cache[key])
+
+        results = self._search(query_bundle)
+        if key:
+            self._cache[key] = results
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return list(results)
+
+    def _search(self, query_bundle):
+        routed = self._candidate_node_ids(query_bundle.query_str)
+        summary = None
+        if self._coarse_to_fine:
+            routed, summary = self._summary_search(query_bundle, routed)
+        results = self._fused_search(query_bundle, routed)
+        return results + [summary] if summary is not None else results
+
+    def _fused_search(self, query_bundle, routed):
+        if not self._hybrid:
+            return self._vector_search(query_bundle, routed)[:self._similarity_top_k]
+
+        # BM25 runs on a worker thread while the query is embedded and scored here
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            lexical_future = executor.submit(self._lexical_search, query_bundle.query_str, routed)
+            vector_hits = self._vector_search(query_bundle, routed)
+            lexical_hits = lexical_future.result()
+
+        nodes = {hit.node.node_id: hit.node for hit in vector_hits}
+        for shard, node_id in lexical_hits:
+            if node_id not in nodes:
+                nodes[node_id] = shard.index.docstore.get_node(node_id)
+
+        fused = reciprocal_rank_fusion(
+            [[hit.node.node_id for hit in vector_hits], [node_id for _, node_id in lexical_hits]],
+            k=self._rrf_k
+        )
+        return [
+            NodeWithScore(node=nodes[node_id], score=score)
+            for node_id, score in fused[:self._similarity_top_k]
+        ]
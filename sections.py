@@ -0,0 +1,231 @@
+import bisect
+import json
+import re
+from dataclasses import asdict, dataclass
+
+from french_analyzer import fold_accents
+
+# "A.1 Activité", "A1 . Activité", "D.3- Autres passifs": sections of the regulatory outline
+LETTER_SECTION = re.compile(r'^([A-E])\s*\.?\s*(\d{1,2})\s*[.-]?\s+([^\W\d_].*)$')
+# "D1.1 . Goodwill", "D2.2.1 . Méthodes": subsections, deeper levels folded into their subsection
+LETTER_SUBSECTION = re.compile(r'^([A-E])\s*\.?\s*(\d{1,2})\.(\d{1,2})(?:\.\d{1,2})*\s*[.-]?\s+([^\W\d_].*)$')
+LETTER_CHAPTER = re.compile(r'^([A-E])\s*\.\s+([^\W\d_].*)$')
+# "2.1 . Périmètre", "6. GESTION DES FONDS PROPRES": reports numbering their own chapters
+NUMBER_SECTION = re.compile(r'^(\d)\s*\.\s*(\d{1,2})\s*\.?\s+([^\W\d_].*)$')
+NUMBER_CHAPTER = re.compile(r'^(\d)\s*\.\s+([^\W\d_].*)$')
+LEADER_DOTS = re.compile(r'\.\s*\.\s*\.')
+# "Système de gestion des risques 28": a title ending with its page number
+PAGE_TAIL = re.compile(r'[^\W\d_][\s.]+\d{1,3}$')
+HEADING_PATTERNS = (LETTER_SUBSECTION, LETTER_SECTION, LETTER_CHAPTER, NUMBER_SECTION, NUMBER_CHAPTER)
+# Longest line of a chapter's own outline, any longer line is a paragraph
+OUTLINE_LINE_LENGTH = 120
+
+# Chapters of the regulatory outline of a SFCR
+CHAPTERS = {
+    "A": "Activité et résultats",
+    "B": "Système de gouvernance",
+    "C": "Profil de risque",
+    "D": "Valorisation à des fins de solvabilité",
+    "E": "Gestion du capital",
+}
+# Chapter titles, once accents are folded, mapped to the letters of the regulatory outline
+CHAPTER_TITLES = [
+    ("A", re.compile(r'^activite')),
+    ("B", re.compile(r'gouvernance')),
+    ("C", re.compile(r'profil de risque|^rofil de risque')),
+    ("D", re.compile(r'^valorisation')),
+    ("E", re.compile(r'gestion (?:du capital|des fonds propres)')),
+]
+
+# Question wording -> titles of the sections that answer it
+ROUTES = [
+    (r"\bscr\b|\bmcr\b|capital requirement|capital (?:de solvabilite )?requis",
+     r"capital de solvabilite requis|minimum de capital|\bscr\b|\bmcr\b"),
+    (r"fonds propres|own funds|ratio de (?:solvabilite|couverture)|solvency ratio|coverage ratio", r"fonds propres"),
+    (r"gouvernance|governance", r"gouvernance"),
+    (r"remuneration", r"remuneration"),
+    (r"competence|honorabilite|fit and proper", r"competence|honorabilite"),
+    (r"\borsa\b|gestion des risques|risk management", r"gestion des risques"),
+    (r"controle interne|internal control", r"controle interne"),
+    (r"\baudit\b", r"\baudit\b"),
+    (r"actuari", r"actuariel"),
+    (r"sous - traitance|sous-traitance|outsourcing", r"sous - traitance|sous-traitance"),
+    (r"risque de souscription|underwriting risk", r"risques? de souscription"),
+    (r"risques? de marche|market risk", r"risques? de marche"),
+    (r"credit|contrepartie|counterparty", r"risques? de (?:credit|contrepartie)"),
+    (r"liquidite|liquidity", r"liquidite"),
+    (r"operationnel|operational", r"operationnel"),
+    (r"provisions techniques|technical provisions|best estimate|marge de risque|risk margin",
+     r"provisions techniques"),
+    (r"resultats? de souscription|underwriting (?:result|performance)|\bprimes\b|premiums",
+     r"resultats? de souscription|portefeuilles de contrats"),
+    (r"investissement|investment|placements", r"investissements|placements"),
+    (r"autres passifs|other liabilities", r"autres passifs"),
+    (r"modele interne|internal model|formule standard|standard formula", r"modele interne|formule standard"),
+]
+ROUTES = [(re.compile(question), re.compile(title)) for question, title in ROUTES]
+
+
+@dataclass
+class Section:
+    """Heading of a report section and where it starts"""
+    id: str  # "A.1", "D.1.1" or the report's own numbering, "2.1"
+    title: str
+    chapter: str  # Letter of the regulatory outline chapter, '' for the front matter
+    page: int
+    offset: int  # Character offset of the heading in its page text
+    parent: str = None
+
+
+def chapter_of(title):
+    """Regulatory outline letter of a chapter title, or ''"""
+    folded = fold_accents(title)
+    for letter, pattern in CHAPTER_TITLES:
+        if pattern.search(folded):
+            return letter
+    return ''
+
+
+def heading_line(line):
+    """A line without its markdown heading marks"""
+    return line.strip().lstrip('#').strip()
+
+
+def toc_entry(line):
+    """A table of contents line without its dotted leaders and page number"""
+    return PAGE_TAIL.sub(lambda match: match.group(0)[0], LEADER_DOTS.split(line)[0]).strip(' .')
+
+
+def is_toc_page(text):
+    """Whether a page is a table of contents, whose headings must not open sections
+
+    Either many of its lines are outline entries, with dotted leaders or page
+    numbers, or it is a chapter's own outline: headings only, no paragraph.
+    """
+    lines = [heading_line(line) for line in text.splitlines() if line.strip()]
+    if len(lines) < 4:
+        return False
+    headings = sum(1 for line in lines if any(pattern.match(line) for pattern in HEADING_PATTERNS))
+    if not any(len(line) > OUTLINE_LINE_LENGTH for line in lines) and headings >= 3:
+        return True
+    entries = sum(1 for line in lines if LEADER_DOTS.search(line) or PAGE_TAIL.search(line) or line.startswith('/'))
+    return len(lines) >= 10 and entries + headings >= 0.4 * len(lines)
+
+
+class SectionTree:
+    """Chapters and sections of one report, in document order"""
+
+    def __init__(self, sections=None):
+        self.sections = list(sections or [])
+        self._positions = [(section.page, section.offset) for section in self.sections]
+        self._ids = {section.id for section in self.sections}
+        self._toc_titles = {}  # Section id -> title read in the tables of contents
+
+    def _append(self, section):
+        # Summaries and running headers repeat headings: a section starts at its first heading
+        if section.id in self._ids:
+            return
+        self._ids.add(section.id)
+        self.sections.append(section)
+        self._positions.append((section.page, section.offset))
+
+    def _current_chapter(self):
+        for section in reversed(self.sections):
+            if section.parent is None:
+                return section
+        return None
+
+    def add_page(self, page, text):
+        """Parse the headings of the next page, only reading the titles of tables of contents"""
+        if is_toc_page(text):
+            self._add_toc_page(page, text)
+            return
+        offset = 0
+        for line in text.splitlines(keepends=True):
+            section = self._parse_heading(heading_line(line), page, offset)
+            if section is not None:
+                self._append(section)
+            offset += len(line)
+
+    def _add_toc_page(self, page, text):
+        offset = 0
+        for i, line in enumerate(text.splitlines(keepends=True)):
+            entry = toc_entry(heading_line(line))
+            for pattern in (LETTER_SUBSECTION, LETTER_SECTION, LETTER_CHAPTER):
+                match = pattern.match(entry)
+                if match:
+                    *numbers, title = match.groups()
+                    self._toc_titles.setdefault('.'.join(numbers), title.strip(' .'))
+                    break
+            # A chapter's own outline opens the chapter with its title
+            match = LETTER_CHAPTER.match(heading_line(line))
+            if (i == 0 and match and chapter_of(match.group(2)) == match.group(1)
+                    and not LEADER_DOTS.search(line) and not PAGE_TAIL.search(line.strip())):
+                self._append(Section(match.group(1), match.group(2).strip(' .'), match.group(1), page, offset))
+            offset += len(line)
+
+    def _open(self, id, chapter, page, offset, parent=None):
+        """Open a section whose heading was lost, titled after the tables of contents"""
+        if id not in self._ids:
+            self._append(Section(id, self._toc_titles.get(id, ''), chapter, page, offset, parent=parent))
+
+    def _parse_heading(self, line, page, offset):
+        chapter = self._current_chapter()
+        match = LETTER_SUBSECTION.match(line)
+        if match:
+            letter, number, sub, title = match.groups()
+            if chapter is None or chapter.chapter != letter:
+                self._open(letter, letter, page, offset)
+            self._open(f"{letter}.{number}", letter, page, offset, parent=letter)
+            return Section(f"{letter}.{number}.{sub}", title.strip(' .'), letter, page, offset, parent=f"{letter}.{number}")
+
+        match = LETTER_SECTION.match(line)
+        if match:
+            letter, number, title = match.groups()
+            if chapter is None or chapter.chapter != letter:
+                # Chapter cover pages often lose their title in the OCR
+                self._open(letter, letter, page, offset)
+            return Section(f"{letter}.{number}", title.strip(' .'), letter, page, offset, parent=letter)
+
+        match = LETTER_CHAPTER.match(line)
+        if match and chapter_of(match.group(2)) == match.group(1):
+            return Section(match.group(1), match.group(2).strip(' .'), match.group(1), page, offset)
+
+        match = NUMBER_CHAPTER.match(line)
+        if match and len(match.group(2)) > 3:
+            return Section(match.group(1), match.group(2).strip(' .'), chapter_of(match.group(2)), page, offset)
+
+        match = NUMBER_SECTION.match(line)
+        if match and chapter is not None and chapter.id == match.group(1):
+            number, sub, title = match.groups()
+            return Section(f"{number}.{sub}", title.strip(' .'), chapter.chapter, page, offset, parent=number)
+        return None
+
+    def section_at(self, page, offset):
+        """Innermost section containing a position, or None in the front matter"""
+        i = bisect.bisect_right(self._positions, (page, offset)) - 1
+        return self.sections[i] if i >= 0 else None
+
+    def route(self, question):
+        """Ids of the sections, and their subsections, whose titles match the question"""
+        folded = fold_accents(question)
+        title_patterns = [title for pattern, title in ROUTES if pattern.search(folded)]
+        if not title_patterns:
+            return set()
+        ids = {
+            section.id for section in self.sections
+            if any(pattern.search(fold_accents(section.title)) for pattern in title_patterns)
+        }
+        for section in self.sections:  # Parents come before their subsections
+            if section.parent in ids:
+                ids.add(section.id)
+        return ids
+
+    def persist(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump([asdict(section) for section in self.sections], f)
+
+    @classmethod
+    def from_persist_path(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls(Section(**section) for section in json.load(f))
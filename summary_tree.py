@@ -0,0 +1,156 @@
+import hashlib
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+
+import numpy as np
+
+PAGE_PROMPT = (
+    "Summarize this page of an insurer's Solvency and Financial Condition Report in at most "
+    "three sentences. Keep the key figures with their units and write in the language of the page.\n\n"
+    "{text}"
+)
+SECTION_PROMPT = (
+    "Summarize the section \"{title}\" of an insurer's Solvency and Financial Condition Report "
+    "in at most five sentences, from the summaries of its pages. Keep the key figures with their units.\n\n"
+    "{summaries}"
+)
+# Characters of a page sent to the LLM; OCR pages rarely exceed it
+MAX_PAGE_CHARS = 12000
+
+
+def digest(*parts):
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+
+@dataclass
+class SummaryNode:
+    """Summary of a section or a page with its embedding and the digest of what it summarizes"""
+    id: str
+    title: str
+    summary: str
+    embedding: list
+    digest: str
+    pages: list = field(default_factory=list)  # Pages of a section, empty for a page
+
+
+def section_pages(sections, last_page):
+    """Pages spanned by each section of a SectionTree, a page shared by two sections belonging to both"""
+    spans = {}
+    for section, following in zip(sections.sections, sections.sections[1:] + [None]):
+        if following is None:
+            end = last_page
+        else:
+            end = following.page if following.offset > 0 else following.page - 1
+        spans.setdefault(section.id, []).extend(range(section.page, max(section.page, end) + 1))
+    return {section_id: sorted(set(pages)) for section_id, pages in spans.items()}
+
+
+class SummaryTree:
+    """Section and page summaries of a report, searched before its chunks
+
+    Summaries are generated once by the LLM and only regenerated when the
+    page text, or the page summaries of a section, change.
+    """
+
+    def __init__(self, sections=None, pages=None):
+        self.sections = {node.id: node for node in sections or []}
+        self.pages = {node.id: node for node in pages or []}
+        self._matrices = {}
+        self.logger = logging.getLogger(__name__)
+
+    def update(self, pages, sections, summarize, embed_model, concurrency=4):
+        """Summarize the new or changed pages of {page: text}, then the sections whose pages changed
+
+        Returns the number of summaries generated.
+        """
+        page_digests = {str(page): digest(text) for page, text in pages.items()}
+        stale = [
+            page for page in pages
+            if str(page) not in self.pages or self.pages[str(page)].digest != page_digests[str(page)]
+        ]
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            page_summaries = list(executor.map(
+                lambda page: summarize(PAGE_PROMPT.format(text=pages[page][:MAX_PAGE_CHARS])), stale
+            ))
+        page_embeddings = embed_model.get_text_embedding_batch(page_summaries) if stale else []
+        self.pages = {id_: node for id_, node in self.pages.items() if id_ in page_digests}
+        for page, summary, embedding in zip(stale, page_summaries, page_embeddings):
+            self.pages[str(page)] = SummaryNode(str(page), '', summary, embedding, page_digests[str(page)])
+
+        spans = section_pages(sections, max(pages, default=0))
+        titles = {section.id: section.title or section.id for section in sections.sections}
+        section_digests = {
+            section_id: digest(titles[section_id], *(page_digests.get(str(page), '') for page in span))
+            for section_id, span in spans.items()
+        }
+        stale_sections = [
+            section_id for section_id in spans
+            if section_id not in self.sections or self.sections[section_id].digest != section_digests[section_id]
+        ]
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            section_summaries = list(executor.map(
+                lambda section_id: summarize(SECTION_PROMPT.format(
+                    title=titles[section_id],
+                    summaries='\n'.join(
+                        self.pages[str(page)].summary for page in spans[section_id] if str(page) in self.pages
+                    )
+                )),
+                stale_sections
+            ))
+        section_embeddings = embed_model.get_text_embedding_batch(section_summaries) if stale_sections else []
+        self.sections = {id_: node for id_, node in self.sections.items() if id_ in spans}
+        for section_id, summary, embedding in zip(stale_sections, section_summaries, section_embeddings):
+            self.sections[section_id] = SummaryNode(
+                section_id, titles[section_id], summary, embedding, section_digests[section_id],
+                pages=spans[section_id]
+            )
+
+        self._matrices = {}
+        generated = len(stale) + len(stale_sections)
+        if generated:
+            self.logger.info(f"Generated {len(stale)} page and {len(stale_sections)} section summaries")
+        return generated
+
+    def _matrix(self, level):
+        """Normalized embeddings of a level ('sections' or 'pages') and their node ids"""
+        if level not in self._matrices:
+            nodes = list(getattr(self, level).values())
+            matrix = np.asarray([node.embedding for node in nodes], dtype=np.float32).reshape(len(nodes), -1)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            self._matrices[level] = ([node.id for node in nodes], matrix / np.maximum(norms, 1e-12))
+        return self._matrices[level]
+
+    @staticmethod
+    def _top(ids, matrix, query, k, allowed=None):
+        if not ids:
+            return []
+        scores = matrix @ query
+        order = np.argsort(-scores)
+        return [(ids[i], float(scores[i])) for i in order if allowed is None or ids[i] in allowed][:k]
+
+    def search(self, query_embedding, top_sections, top_pages):
+        """Best sections, then their best pages, as ([(section node, score)], [page numbers])"""
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        sections = self._top(*self._matrix('sections'), query, top_sections)
+        allowed = {str(page) for section_id, _ in sections for page in self.sections[section_id].pages}
+        pages = self._top(*self._matrix('pages'), query, top_pages, allowed)
+        return [(self.sections[id_], score) for id_, score in sections], [int(id_) for id_, _ in pages]
+
+    def persist(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "sections": [asdict(node) for node in self.sections.values()],
+                "pages": [asdict(node) for node in self.pages.values()],
+            }, f)
+
+    @classmethod
+    def from_persist_path(cls, path):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(
+            sections=[SummaryNode(**node) for node in data["sections"]],
+            pages=[SummaryNode(**node) for node in data["pages"]]
+        )
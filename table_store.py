@@ -0,0 +1,249 @@
+import logging
+import os
+import sqlite3
+import re
+import threading
+
+from french_analyzer import FrenchAnalyzer
+from key_figures import METRICS, KeyFigureIndex
+from node_parsers import MAX_CAPTION_LINES, MAX_CAPTION_WORDS, NUMBER_TOKEN, Block, is_caption_line, split_blocks
+from page_reader import company_from_filename, file_digest, iter_pages
+
+# Bumped when the extraction changes, so files are extracted again
+EXTRACTION_VERSION = 3
+# Captions of charts and tables, whose trailing number is not a figure
+CAPTION_PREFIX = re.compile(r'^(?:tableau|figure|graphique|etat|état)\b', re.IGNORECASE)
+KEY_FIGURES_CAPTION = "Chiffres clés"
+DATE = re.compile(r'^(?:\d{1,2}[./]\d{1,2}[./])?(?:19|20)\d{2}$')
+
+
+def parse_number(text):
+    """Parse a single figure such as '1 234,5', '(12)' or '144 %', or return None"""
+    text = text.replace(' ', '').replace('\xa0', '').rstrip('%')
+    negative = text.startswith('(') and text.endswith(')')
+    text = text.strip('()')
+    if ',' in text and '.' not in text:
+        text = text.replace(',', '.')
+    try:
+        value = float(text)
+    except ValueError:
+        return None
+    return -value if negative else value
+
+
+def split_cells(line):
+    return [cell.strip() for cell in line.strip().strip('|').split('|')]
+
+
+def is_pipe_table(block):
+    return bool(block.header) and block.header[0].lstrip().startswith('|')
+
+
+def table_caption(block):
+    """Readable header of a table: the columns of a `|` table, or the OCR label lines"""
+    if is_pipe_table(block):
+        return ', '.join(cell for cell in split_cells(block.header[0]) if cell)
+    return ' / '.join(line.strip().lstrip('# ') for line in block.header)
+
+
+def figure_values(tokens):
+    """(raw figure, value) pairs of the figure tokens of an OCR row, or None when they are ambiguous
+
+    "63 %", "(12)" or "-1,98 -2,69" read unambiguously, but "2 808 449 911"
+    may be one figure or several since spaces also separate thousands.
+    """
+    figures = []
+    for token in tokens:
+        if token == '%' and figures and not figures[-1].endswith('%'):
+            figures[-1] += ' %'
+        else:
+            figures.append(token)
+    if len(figures) > 1 and not all(any(char in figure for char in ',%(-+') for figure in figures):
+        return None
+    values = [(figure, parse_number(figure)) for figure in figures]
+    return None if any(value is None for _, value in values) else values
+
+
+def is_figure_row(line):
+    """Whether a prose line is a label followed by its figures, as the OCR renders small tables
+
+    "Ratio de solvabilité 160 %" or "Valeur Statutaire 7,693" are figure
+    rows; a year or page number alone ("Exercice 2022", "# 36") is not.
+    """
+    line = line.strip().lstrip('# ')
+    tokens = line.split()
+    figures = 0
+    while figures < len(tokens) and NUMBER_TOKEN.match(tokens[-1 - figures]):
+        figures += 1
+    words = tokens[:len(tokens) - figures]
+    if not figures or not words or len(words) > MAX_CAPTION_WORDS or CAPTION_PREFIX.match(line):
+        return False
+    if not any(any(char.isalpha() for char in word) for word in words) or words[-1] in ('.', '...'):
+        return False
+    raw = tokens[len(words):]
+    # A single integer is a page or an article number more often than a figure
+    return not (len(raw) == 1 and (DATE.match(raw[0]) or raw[0].isdigit()))
+
+
+def figure_tables(block):
+    """Runs of figure rows within a prose block, as tables headed by the label lines just above them"""
+    run, caption = [], []
+    for line in block.lines + ['']:
+        if is_figure_row(line):
+            run.append(line)
+            continue
+        if run:
+            yield Block('table', run, caption)
+            run, caption = [], []
+        caption = (caption + [line])[-MAX_CAPTION_LINES:] if is_caption_line(line) else []
+
+
+def table_rows(block):
+    """(label, column, raw figure, value) cells of a table block
+
+    Cells of `|` tables are named after the header row. OCR figure rows
+    have no columns: each figure is a cell of the row, labeled with its
+    leading words, unless thousands separators make the figures ambiguous;
+    the row is then kept whole, without a value.
+    """
+    if is_pipe_table(block):
+        columns = split_cells(block.header[0])
+        for line in block.lines:
+            cells = split_cells(line)
+            label = cells[0] if cells else ''
+            for column, cell in zip(columns[1:], cells[1:]):
+                if cell:
+                    yield label, column, cell, parse_number(cell)
+        return
+
+    for line in block.lines:
+        tokens = line.lstrip('# ').split()
+        words = []
+        while tokens and not NUMBER_TOKEN.match(tokens[0]):
+            words.append(tokens.pop(0))
+        values = figure_values(tokens) if tokens else None
+        if values is None:
+            yield ' '.join(words), None, ' '.join(tokens), None
+            continue
+        for raw, value in values:
+            yield ' '.join(words), None, raw, value
+
+
+class TableStore:
+    """SQLite store of the tables found in the OCR files, with file, company and page provenance"""
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.analyzer = FrenchAnalyzer()
+        self._extractor = f"{self.analyzer.name}/{EXTRACTION_VERSION}"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS files (file TEXT PRIMARY KEY, digest TEXT NOT NULL, analyzer TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS tables (
+                id INTEGER PRIMARY KEY, file TEXT NOT NULL, company TEXT NOT NULL,
+                page INTEGER NOT NULL, caption TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS cells (
+                table_id INTEGER NOT NULL, row INTEGER NOT NULL, label TEXT NOT NULL,
+                col TEXT, raw TEXT NOT NULL, value REAL, terms TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS tables_file ON tables (file);
+            CREATE INDEX IF NOT EXISTS cells_table ON cells (table_id);
+        ''')
+        self._conn.commit()
+        self.logger = logging.getLogger(__name__)
+
+    def _terms(self, *texts):
+        """Analyzed terms of a cell, padded with spaces so whole terms can be matched with instr"""
+        return f" {' '.join(self.analyzer.analyze(' '.join(texts)))} "
+
+    def sync_file(self, file_path):
+        """Extract the tables of a file unless they are up to date, returning how many were stored"""
+        file_name = os.path.basename(file_path)
+        digest = file_digest(file_path)
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT digest, analyzer FROM files WHERE file = ?', (file_name,)
+            ).fetchone()
+        if row == (digest, self._extractor):
+            return 0
+
+        company = company_from_filename(file_name)
+        extracted, key_figures = [], KeyFigureIndex()
+        for page, text in iter_pages(file_path):
+            key_figures.add_page(page, text)
+            for block in split_blocks(text):
+                tables = [block] if block.kind == 'table' else figure_tables(block)
+                extracted.extend((page, table_caption(table), list(table_rows(table))) for table in tables)
+        # Key figures are mostly stated in prose: each is stored as a one row table
+        for metric, (label, _, unit) in METRICS.items():
+            figure = key_figures.get(metric)
+            if figure is not None:
+                extracted.append((figure.page, KEY_FIGURES_CAPTION, [(label, unit, figure.text, figure.value)]))
+
+        with self._lock:
+            self._conn.execute(
+                'DELETE FROM cells WHERE table_id IN (SELECT id FROM tables WHERE file = ?)', (file_name,)
+            )
+            self._conn.execute('DELETE FROM tables WHERE file = ?', (file_name,))
+            for page, caption, rows in extracted:
+                table_id = self._conn.execute(
+                    'INSERT INTO tables (file, company, page, caption) VALUES (?, ?, ?, ?)',
+                    (file_name, company, page, caption)
+                ).lastrowid
+                self._conn.executemany('INSERT INTO cells VALUES (?, ?, ?, ?, ?, ?, ?)', [
+                    (
+                        table_id, row, label, column, raw, value,
+                        self._terms(caption, label, column or '')
+                    )
+                    for row, (label, column, raw, value) in enumerate(rows)
+                ])
+            self._conn.execute(
+                'INSERT OR REPLACE INTO files VALUES (?, ?, ?)', (file_name, digest, self._extractor)
+            )
+            self._conn.commit()
+        self.logger.info(f"Stored {len(extracted)} tables of {file_name}")
+        return len(extracted)
+
+    def companies(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute('SELECT DISTINCT company FROM tables')]
+
+    def lookup(self, question, files=None, limit=10):
+        """Cells whose table caption, row label or column matches the question, best first
+
+        Companies named in the question restrict the search to their
+        files; a cell must match all but a third of the other terms.
+        """
+        terms = list(dict.fromkeys(self.analyzer.analyze(question)))
+        companies = [company for company in self.companies() if company in terms]
+        terms = [term for term in terms if term not in companies]
+        if not terms:
+            return []
+
+        score = ' + '.join(['(instr(c.terms, ?) > 0)'] * len(terms))
+        term_params = [f" {term} " for term in terms]
+        # The score is computed once in the select list and once in the filter
+        conditions = [f"({score}) >= ?"]
+        params = term_params + term_params + [len(terms) - len(terms) // 3]
+        if files is not None:
+            conditions.append(f"t.file IN ({','.join('?' * len(files))})")
+            params.extend(files)
+        if companies:
+            conditions.append(f"t.company IN ({','.join('?' * len(companies))})")
+            params.extend(companies)
+        params.append(limit)
+
+        sql = (
+            f"SELECT t.company, t.file, t.page, t.caption, c.label, c.col, c.raw, c.value, {score} AS score "
+            f"FROM cells c JOIN tables t ON t.id = c.table_id "
+            f"WHERE {' AND '.join(conditions)} "
+            f"ORDER BY score DESC, t.company, t.page, c.row LIMIT ?"
+        )
+        columns = ('company', 'file', 'page', 'caption', 'label', 'column', 'raw', 'value', 'score')
+        with self._lock:
+            return [dict(zip(columns, row)) for row in self._conn.execute(sql, params)]
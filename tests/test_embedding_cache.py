@@ -0,0 +1,49 @@
+import itertools
+
+import pytest
+
+import embedding_cache
+from embedding_cache import EmbeddingCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    ticks = itertools.count(1)
+    monkeypatch.setattr(embedding_cache.time, 'time', lambda: float(next(ticks)))
+
+
+def last_used(cache, model_name, text):
+    return cache._conn.execute(
+        'SELECT last_used FROM embeddings WHERE key = ?', (cache.key(model_name, text),)
+    ).fetchone()[0]
+
+
+def test_round_trip(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), max_entries=10)
+    cache.put_many("m", ["a", "b"], [[0.5, 1.0], [2.0, -1.0]])
+    assert cache.get_many("m", ["a", "c", "b"]) == [[0.5, 1.0], None, [2.0, -1.0]]
+    assert cache.get_many("other", ["a"]) == [None]
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 2
+
+
+def test_evicts_least_recently_used(tmp_path, clock):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), max_entries=4)
+    for text in "abcd":
+        cache.put_many("m", [text], [[1.0]])
+    cache.get_many("m", ["a"])
+    cache.put_many("m", ["e"], [[1.0]])
+    # Down to 90% of the bound: the two least recently used entries go, the read one stays
+    assert cache.get_many("m", list("abcde")) == [[1.0], None, None, [1.0], [1.0]]
+    assert cache.stats()["entries"] == 3
+
+
+def test_reads_are_written_in_batches(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(embedding_cache, 'TOUCH_BATCH_SIZE', 2)
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), max_entries=10)
+    cache.put_many("m", ["a", "b"], [[1.0], [2.0]])
+    stored = last_used(cache, "m", "a")
+    cache.get_many("m", ["a"])
+    assert last_used(cache, "m", "a") == stored
+    cache.get_many("m", ["b"])
+    assert last_used(cache, "m", "a") > stored
+    assert last_used(cache, "m", "b") > last_used(cache, "m", "a")
@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+from job_queue import DONE, FAILED, PENDING, RUNNING, JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs"))
+
+
+@pytest.fixture
+def report(tmp_path):
+    path = tmp_path / "predicted_acme-output-1-to-2.txt"
+    path.write_text("=======page 1=======\nACME\n", encoding='utf-8')
+    return str(path)
+
+
+def test_submit_is_idempotent(queue, report):
+    job_id = queue.submit(report, {"chunk_size": 512})
+    assert queue.submit(report, {"chunk_size": 512}) == job_id
+    assert queue.submit(report, {"chunk_size": 1024}) != job_id
+    assert queue.get(job_id).state == PENDING
+
+
+def test_a_job_is_claimed_once(queue, report):
+    job_id = queue.submit(report, {})
+    job = queue.claim()
+    assert (job.id, job.state) == (job_id, RUNNING)
+    assert queue.claim() is None
+    queue.finish(job, result={"nodes_embedded": 3})
+    assert queue.get(job_id).state == DONE
+    assert queue.get(job_id).result == {"nodes_embedded": 3}
+
+
+def test_failed_job_is_retried(queue, report):
+    job_id = queue.submit(report, {})
+    queue.finish(queue.claim(), error="quota exceeded")
+    assert (queue.get(job_id).state, queue.get(job_id).error) == (FAILED, "quota exceeded")
+    assert queue.submit(report, {}) == job_id
+    assert queue.get(job_id).state == PENDING
+    assert queue.claim().id == job_id
+
+
+def test_stale_running_job_is_requeued(queue, report):
+    job_id = queue.submit(report, {})
+    queue.claim()
+    queue.requeue_stale(timeout=60)
+    assert queue.get(job_id).state == RUNNING
+    path = os.path.join(queue.spool_dir, RUNNING, f"{job_id}.json")
+    os.utime(path, (0, 0))
+    queue.requeue_stale(timeout=60)
+    assert queue.get(job_id).state == PENDING
+    assert queue.claim().id == job_id
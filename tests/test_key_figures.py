@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+from key_figures import KeyFigureIndex, metrics_in
+from page_reader import iter_pages
+
+TXT_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'txt_files')
+
+# Figures stated in the shipped reports; None when a report only gives it in a table
+EXPECTED = {
+    "predicted_allianz-1-to-94.txt": {
+        "solvency_ratio": 144.0,
+        "scr": 2_808_449e3,
+        "mcr": 911_109e3,
+        "eligible_own_funds": None,
+        "gross_written_premiums": 5_194_327e3,
+    },
+    "predicted_axa-output-1-to-71.txt": {
+        "solvency_ratio": 254.0,
+        "scr": 22_961e6,
+        "mcr": 5_740e6,
+        "eligible_own_funds": 58_317e6,
+        "gross_written_premiums": 5_934e6,
+    },
+    "predicted_camca-output-1-to-49.txt": {
+        "solvency_ratio": 206.0,
+        "scr": 443e6,
+        "eligible_own_funds": 911e6,
+        "gross_written_premiums": 722e6,  # "722 M  en 2022", the euro sign lost by the OCR
+    },
+    "predicted_covea-output-1-to-98.txt": {
+        "solvency_ratio": 226.0,
+        "scr": 12_464e6,
+        "mcr": 4_064e6,
+        "eligible_own_funds": 28_143e6,
+        "gross_written_premiums": 15_306e6,  # Earned premiums, the turnover of a mutual group
+    },
+}
+
+
+def key_figures(file_name):
+    index = KeyFigureIndex()
+    for page, text in iter_pages(os.path.join(TXT_DIR, file_name)):
+        index.add_page(page, text)
+    return index
+
+
+@pytest.mark.parametrize("file_name", sorted(EXPECTED))
+def test_key_figures_of_shipped_reports(file_name):
+    index = key_figures(file_name)
+    for metric, expected in EXPECTED[file_name].items():
+        figure = index.get(metric)
+        assert (figure.value if figure else None) == expected, metric
+
+
+@pytest.mark.parametrize("question, metrics", [
+    ("Quel est le ratio de solvabilité de Covéa ?", ["solvency_ratio"]),
+    ("Quel est le montant des fonds propres éligibles d’AXA ?", ["eligible_own_funds"]),
+    ("What was AXA's SCR in 2021?", ["scr"]),
+    ("What is the gross written premium of AXA?", ["gross_written_premiums"]),
+    ("What were the gross written premiums of Covéa in 2022?", ["gross_written_premiums"]),
+    ("Quel est le chiffre d'affaires d'AXA ?", ["gross_written_premiums"]),
+    ("Quelles sont les primes brutes émises d'Allianz ?", ["gross_written_premiums"]),
+    ("Quel est le chiffre du SCR d'AXA ?", ["scr"]),
+    ("Quelle est la composition des fonds propres d'AXA ?", []),
+    ("Quels sont les principaux risques qui pèsent sur le SCR ?", []),
+    ("Qu'est-ce que le SCR ?", []),
+    ("Quelle est la politique de gestion des fonds propres ?", []),
+    ("Quel est le MCR de Covéa et pourquoi a-t-il augmenté ?", []),
+])
+def test_only_explicit_lookups_take_the_fast_path(question, metrics):
+    assert metrics_in(question) == metrics
@@ -0,0 +1,46 @@
+import pytest
+
+from lexical_index import BM25Index
+from retrievers import reciprocal_rank_fusion
+
+
+class Analyzer:
+    name = "other"
+
+    @staticmethod
+    def analyze(text):
+        return text.split()
+
+
+@pytest.fixture
+def index():
+    index = BM25Index()
+    index.add("n1", "Le capital de solvabilité requis s'élève à 2 808 millions", ref_doc_id="p1")
+    index.add("n2", "Les fonds propres éligibles couvrent le capital de solvabilité requis", ref_doc_id="p1")
+    index.add("n3", "La gouvernance de la société repose sur le conseil d'administration", ref_doc_id="p2")
+    return index
+
+
+def test_search_ranks_matching_nodes(index):
+    assert [node_id for node_id, _ in index.search("fonds propres", 3)] == ["n2"]
+    assert {node_id for node_id, _ in index.search("capital de solvabilité", 3)} == {"n1", "n2"}
+    assert [node_id for node_id, _ in index.search("capital", 3, node_ids={"n1"})] == ["n1"]
+
+
+def test_remove_ref_doc(index):
+    index.remove_ref_doc("p1")
+    assert len(index) == 1
+    assert index.search("capital", 3) == []
+
+
+def test_persist_round_trip(index, tmp_path):
+    path = str(tmp_path / "lexical.json")
+    index.persist(path)
+    assert BM25Index.from_persist_path(path).search("gouvernance", 3) == index.search("gouvernance", 3)
+    # Terms analyzed by another analyzer would never match a query
+    with pytest.raises(ValueError):
+        BM25Index.from_persist_path(path, analyzer=Analyzer())
+
+
+def test_reciprocal_rank_fusion():
+    assert reciprocal_rank_fusion([["a", "b", "c"], ["c", "a"]], k=1)[0][0] == "a"
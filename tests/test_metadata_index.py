@@ -0,0 +1,31 @@
+import pytest
+from llama_index.core.vector_stores.types import FilterCondition, FilterOperator, MetadataFilter, MetadataFilters
+
+from metadata_index import MetadataIndex
+
+
+@pytest.fixture
+def index():
+    return MetadataIndex.from_metadata([
+        ("n1", {"company": "axa", "year": 2022, "page": 3}),
+        ("n2", {"company": "axa", "year": 2022, "page": 40}),
+        ("n3", {"company": "covea", "year": 2021, "page": 12}),
+    ])
+
+
+def test_select(index):
+    assert index.select(MetadataFilters(filters=[MetadataFilter(key="company", value="axa")])) == {"n1", "n2"}
+    assert index.select(MetadataFilters(filters=[
+        MetadataFilter(key="company", value="axa"),
+        MetadataFilter(key="page", value=10, operator=FilterOperator.GTE),
+    ])) == {"n2"}
+    assert index.select(MetadataFilters(filters=[
+        MetadataFilter(key="year", value=2021),
+        MetadataFilter(key="page", value=[3], operator=FilterOperator.IN),
+    ], condition=FilterCondition.OR)) == {"n1", "n3"}
+    assert index.select(MetadataFilters(filters=[])) == {"n1", "n2", "n3"}
+
+
+def test_select_unindexed_key(index):
+    with pytest.raises(ValueError):
+        index.select(MetadataFilters(filters=[MetadataFilter(key="file", value="axa.txt")]))
@@ -0,0 +1,17 @@
+from node_parsers import split_blocks
+
+
+def test_pipe_table():
+    blocks = split_blocks("Tableau 1\n| Poste | 2022 |\n|---|---|\n| SCR | 1 234 |\nFin.")
+    assert [(block.kind, block.header, block.lines) for block in blocks] == [
+        ('text', [], ["Tableau 1"]),
+        ('table', ["| Poste | 2022 |", "|---|---|"], ["| SCR | 1 234 |"]),
+        ('text', [], ["Fin."]),
+    ]
+
+
+def test_header_only_pipe_table_is_kept_as_text():
+    blocks = split_blocks("Tableau 1\n| Poste | 2022 |\n|---|---|\nFin.")
+    assert [(block.kind, block.lines) for block in blocks] == [
+        ('text', ["Tableau 1", "| Poste | 2022 |", "|---|---|", "Fin."]),
+    ]
@@ -0,0 +1,66 @@
+import pytest
+from llama_index.core.schema import NodeRelationship, RelatedNodeInfo, TextNode
+
+from node_snapshot import LazyNodeKVStore, NodeSnapshot, pack_metadata, unpack_metadata, write_nodes
+
+NODES = [
+    TextNode(
+        id_=f"n{i}",
+        text=f"Texte du nœud {i} : ratio de solvabilité {140 + i} %",
+        metadata={"page": i, "company": "acme"} if i else {"page": 0},
+        excluded_embed_metadata_keys=["page"],
+        start_char_idx=10 * i,
+        end_char_idx=10 * i + 9,
+        relationships={NodeRelationship.SOURCE: RelatedNodeInfo(node_id=f"p{i // 2}")}
+    )
+    for i in range(3)
+]
+# Ids, source document ids, metadata and rows, as the snapshot's vector store holds them
+COLUMNS = (
+    [node.node_id for node in NODES],
+    [node.ref_doc_id for node in NODES],
+    [node.metadata for node in NODES],
+    {node.node_id: row for row, node in enumerate(NODES)},
+)
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    write_nodes(str(tmp_path), NODES)
+    return NodeSnapshot(str(tmp_path), columns=COLUMNS)
+
+
+def test_metadata_columns_round_trip():
+    metadata = [node.metadata for node in NODES]
+    assert unpack_metadata(pack_metadata(metadata), len(metadata)) == metadata
+
+
+def test_nodes_round_trip(snapshot):
+    assert len(snapshot) == 3
+    for row, node in enumerate(NODES):
+        loaded = snapshot.node(row)
+        assert (loaded.node_id, loaded.text, loaded.metadata, loaded.ref_doc_id) == (
+            node.node_id, node.text, node.metadata, node.ref_doc_id
+        )
+        assert (loaded.start_char_idx, loaded.end_char_idx) == (node.start_char_idx, node.end_char_idx)
+        assert loaded.excluded_embed_metadata_keys == ["page"]
+
+
+def test_snapshot_out_of_step_with_its_vector_store(tmp_path):
+    write_nodes(str(tmp_path), NODES[:2])
+    with pytest.raises(ValueError):
+        NodeSnapshot(str(tmp_path), columns=COLUMNS)
+
+
+def test_lazy_store_overlays_writes_on_the_snapshot(snapshot):
+    store = LazyNodeKVStore(snapshot)
+    assert store.get("n1", "docstore/data") is not None
+    assert store.get("p0", "docstore/ref_doc_info")["node_ids"] == ["n0", "n1"]
+
+    assert store.delete("n1", "docstore/data")
+    assert store.get("n1", "docstore/data") is None
+    assert not store.delete("n1", "docstore/data")
+    store.put("n4", {"value": 4}, "docstore/data")
+    assert set(store.get_all("docstore/data")) == {"n0", "n2", "n4"}
+    # The snapshot itself is never modified
+    assert LazyNodeKVStore(snapshot).get("n1", "docstore/data") is not None
@@ -0,0 +1,75 @@
+import os
+from collections import Counter
+
+import pytest
+
+from page_reader import iter_pages
+from sections import SectionTree, is_toc_page
+
+TXT_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'txt_files')
+
+ALLIANZ = "predicted_allianz-1-to-94.txt"
+AXA = "predicted_axa-output-1-to-71.txt"
+CAMCA = "predicted_camca-output-1-to-49.txt"
+COVEA = "predicted_covea-output-1-to-98.txt"
+
+# Question -> sections of each shipped report it must be routed to
+ROUTED = {
+    "Quelle est la gouvernance de la société ?": {ALLIANZ: {"B"}, AXA: {"B"}, CAMCA: {"3"}, COVEA: {"B"}},
+    "Comment sont calculées les provisions techniques ?": {
+        ALLIANZ: {"D.2"}, AXA: {"D.2"}, CAMCA: {"5.3"}, COVEA: {"D.2", "D.2.1"},
+    },
+    "Quel est le SCR ?": {ALLIANZ: {"E.2"}, AXA: {"E.2"}, CAMCA: {"6.2"}, COVEA: {"E.2"}},
+}
+
+
+def section_tree(file_name):
+    tree = SectionTree()
+    for page, text in iter_pages(os.path.join(TXT_DIR, file_name)):
+        tree.add_page(page, text)
+    return tree
+
+
+@pytest.mark.parametrize("file_name", [ALLIANZ, AXA, CAMCA, COVEA])
+def test_sections_are_unique(file_name):
+    tree = section_tree(file_name)
+    duplicated = [id_ for id_, count in Counter(section.id for section in tree.sections).items() if count > 1]
+    assert duplicated == []
+
+
+@pytest.mark.parametrize("question", sorted(ROUTED))
+@pytest.mark.parametrize("file_name", [ALLIANZ, AXA, CAMCA, COVEA])
+def test_route_shipped_reports(question, file_name):
+    assert ROUTED[question][file_name] <= section_tree(file_name).route(question)
+
+
+def test_chapter_outline_is_not_a_section():
+    tree = section_tree(AXA)
+    assert [tree.section_at(page, 0).id for page in range(45, 55)] == ["D"] * 10
+    assert tree.section_at(11, 100).id == "A"
+
+
+def test_chapter_titles_survive_table_of_contents():
+    tree = section_tree(AXA)
+    assert {section.id: section.title for section in tree.sections if section.parent is None} == {
+        "A": "ACTIVITÉ ET RÉSULTATS",
+        "B": "SYSTÈME DE GOUVERNANCE",
+        "C": "PROFIL DE RISQUE",
+        "D": "VALORISATION  DES FINS DE SOLVABILITÉ",
+        "E": "GESTION DU CAPITAL",
+    }
+
+
+def test_subsection_headings():
+    tree = section_tree(COVEA)
+    sections = {section.id: section for section in tree.sections}
+    assert sections["D.1.1"].title == "Goodwill"
+    assert sections["D.1.1"].parent == "D.1"
+    assert sections["D.1"].title == "Actifs"
+
+
+def test_toc_page_with_page_numbers():
+    entries = "\n".join(f"Présentation de la partie {name} {4 * number}" for number, name in enumerate("abcdefghijkl"))
+    prose = "Une phrase de paragraphe sans numéro de page. " * 4
+    assert is_toc_page(f"Sommaire\n{entries}\n{prose}")
+    assert not is_toc_page(f"# A.1 Activité\n{prose}\n{prose}\n{prose}\n{prose}")
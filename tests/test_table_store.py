@@ -0,0 +1,66 @@
+import pytest
+
+from table_store import TableStore, figure_values, is_figure_row
+
+PAGES = """=======page 1=======
+ACME VIE
+RAPPORT SUR LA SOLVABILITÉ ET LA SITUATION FINANCIÈRE 2022
+
+=======page 36=======
+# E.1 . Fonds propres
+Le ratio de solvabilité au 31 décembre 2022 est de 144 % contre 160 % au 31 décembre 2021 , en raison du contexte de marchés financiers .
+Evolution des fonds propres
+Ratio de solvabilit  160 %
+Résultat technique  ( 12 )
+Fonds propres éligibles  2 808 449 911
+"""
+
+
+@pytest.fixture
+def store(tmp_path):
+    report = tmp_path / "predicted_acme-output-1-to-36.txt"
+    report.write_text(PAGES, encoding='utf-8')
+    store = TableStore(str(tmp_path / "tables.db"))
+    store.sync_file(str(report))
+    return store
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("Ratio de solvabilité 160 %", True),
+    ("Valeur Statutaire 7,693", True),
+    ("Exercice 2022", False),
+    ("# 36", False),
+])
+def test_figure_row(line, expected):
+    assert is_figure_row(line) == expected
+
+
+@pytest.mark.parametrize("tokens, expected", [
+    (["160", "%"], [("160 %", 160.0)]),
+    (["(", "12", ")"], None),
+    (["(12)"], [("(12)", -12.0)]),
+    (["-1,98", "-2,69"], [("-1,98", -1.98), ("-2,69", -2.69)]),
+    (["2", "808", "449", "911"], None),
+])
+def test_figure_values(tokens, expected):
+    assert figure_values(tokens) == expected
+
+
+def test_lookup_figure_rows(store):
+    rows = store.lookup("Quel est le ratio de solvabilité d'Acme ?")
+    assert ("Ratio de solvabilit", 160.0) in [(row['label'], row['value']) for row in rows]
+    assert all(row['company'] == "acme" for row in rows)
+
+
+def test_lookup_key_figures(store):
+    rows = store.lookup("What is the solvency ratio of Acme?")
+    assert [(row['label'], row['raw'], row['value'], row['page']) for row in rows if row['caption'] == "Chiffres clés"] == [
+        ("Solvency ratio", "144 %", 144.0, 36)
+    ]
+
+
+def test_ambiguous_figures_are_kept_whole(store):
+    rows = store.lookup("fonds propres éligibles")
+    assert [(row['raw'], row['value']) for row in rows if row['label'] == "Fonds propres éligibles"] == [
+        ("2 808 449 911", None)
+    ]
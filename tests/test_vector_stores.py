@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+from llama_index.core.schema import NodeRelationship, RelatedNodeInfo, TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from vector_stores import IVFFlatVectorStore, NumpyVectorStore, load_vector_store
+
+
+def make_node(node_id, embedding, ref_doc_id=None):
+    return TextNode(
+        id_=node_id,
+        text=node_id,
+        embedding=list(map(float, embedding)),
+        relationships={NodeRelationship.SOURCE: RelatedNodeInfo(node_id=ref_doc_id)} if ref_doc_id else {}
+    )
+
+
+def clustered_nodes(clusters=4, size=100, dim=8):
+    """Nodes around `clusters` orthogonal directions, named after their cluster"""
+    rng = np.random.default_rng(0)
+    return [
+        make_node(f"c{cluster}-{i}", np.eye(dim)[cluster] + 0.05 * rng.standard_normal(dim))
+        for cluster in range(clusters) for i in range(size)
+    ]
+
+
+def search(store, embedding, k=1):
+    result = store.query(VectorStoreQuery(query_embedding=list(map(float, embedding)), similarity_top_k=k))
+    return result.ids, result.similarities
+
+
+def test_delete_moves_the_last_row_into_place():
+    store = NumpyVectorStore()
+    store.add([make_node(f"n{i}", np.eye(4)[i], ref_doc_id) for i, ref_doc_id in enumerate("abac")])
+    store.delete("a")
+    ids, _, _, rows = store.columns
+    assert ids == ["n3", "n1"]
+    assert rows == {"n3": 0, "n1": 1}
+    assert search(store, np.eye(4)[3])[0] == ["n3"]
+    assert search(store, np.eye(4)[1])[0] == ["n1"]
+    store.delete("n3")
+    assert len(store) == 1 and search(store, np.eye(4)[3], k=2)[0] == ["n1"]
+
+
+def test_ivf_probes_the_closest_cells(tmp_path):
+    nodes = clustered_nodes()
+    store = IVFFlatVectorStore(nlist=4, nprobe=1, min_train_size=100)
+    store.add(nodes)
+    assert store.train()
+    query = np.eye(8)[2]
+    probed = store._probe_rows(query, store._lists)
+    assert {store.columns[0][row].split('-')[0] for row in probed} == {"c2"}
+
+    exact = NumpyVectorStore()
+    exact.add(nodes)
+    assert search(store, query, k=5)[0] == search(exact, query, k=5)[0]
+
+    store.persist(str(tmp_path / "default__vector_store.json"))
+    loaded = load_vector_store(str(tmp_path), nprobe=2)
+    assert isinstance(loaded, IVFFlatVectorStore) and loaded.nprobe == 2
+    assert search(loaded, query, k=5)[0] == search(exact, query, k=5)[0]
+
+
+def test_small_ivf_store_is_searched_exhaustively():
+    store = IVFFlatVectorStore(min_train_size=1000)
+    store.add(clustered_nodes())
+    assert not store.train()
+    assert search(store, np.eye(8)[3])[0][0].startswith("c3-")
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_quantized_store_rescores_exactly(tmp_path, dtype):
+    rng = np.random.default_rng(1)
+    nodes = [make_node(f"n{i}", rng.standard_normal(16)) for i in range(300)]
+    exact, quantized = NumpyVectorStore(), NumpyVectorStore(dtype=dtype, rescore_factor=4)
+    exact.add(nodes)
+    quantized.add(nodes)
+    query = rng.standard_normal(16)
+    ids, similarities = search(quantized, query, k=5)
+    expected_ids, expected_similarities = search(exact, query, k=5)
+    assert ids == expected_ids
+    # Scores of the returned rows come from the float32 matrix, not the codes
+    assert similarities == pytest.approx(expected_similarities, abs=1e-6)
+
+    quantized.persist(str(tmp_path / "default__vector_store.json"))
+    loaded = load_vector_store(str(tmp_path))
+    assert isinstance(loaded.embeddings, np.memmap) and loaded._codes.dtype == np.dtype(dtype)
+    assert search(loaded, query, k=5)[0] == expected_ids
@@ -0,0 +1,523 @@
+import json
+import os
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    FilterCondition,
+    FilterOperator,
+    MetadataFilters,
+    VectorStoreQueryResult,
+)
+
+from node_snapshot import pack_metadata, unpack_metadata
+from object_size import object_bytes
+
+DEFAULT_PERSIST_FNAME = 'default__vector_store.json'
+SEARCH_PARAMS = {'nprobe', 'rescore_factor'}  # Parameters that can change without rebuilding a store
+
+_OPERATORS = {
+    FilterOperator.EQ: lambda value, target: value == target,
+    FilterOperator.NE: lambda value, target: value != target,
+    FilterOperator.GT: lambda value, target: value is not None and value > target,
+    FilterOperator.GTE: lambda value, target: value is not None and value >= target,
+    FilterOperator.LT: lambda value, target: value is not None and value < target,
+    FilterOperator.LTE: lambda value, target: value is not None and value <= target,
+    FilterOperator.IN: lambda value, target: value in target,
+    FilterOperator.NIN: lambda value, target: value not in target,
+}
+
+
+def metadata_matches(metadata, filters):
+    """Evaluate (possibly nested) MetadataFilters against a node's metadata"""
+    results = []
+    for metadata_filter in filters.filters:
+        if isinstance(metadata_filter, MetadataFilters):
+            results.append(metadata_matches(metadata, metadata_filter))
+        else:
+            compare = _OPERATORS.get(metadata_filter.operator)
+            if compare is None:
+                raise ValueError(f"Unsupported filter operator: {metadata_filter.operator}")
+            results.append(compare(metadata.get(metadata_filter.key), metadata_filter.value))
+    if filters.condition == FilterCondition.OR:
+        return any(results)
+    return all(results)
+
+
+class NumpyVectorStore(BasePydanticVectorStore):
+    """Flat vector store keeping every embedding in one contiguous float32 matrix
+
+    Rows are L2-normalized on insertion so a query is scored with a single
+    matrix-vector product, and the top-k rows are selected with argpartition.
+
+    With `dtype` set to 'float16' or 'int8' (per-row scalar quantization), queries
+    are scored against the compact resident copy, and the best
+    `similarity_top_k * rescore_factor` candidates are rescored exactly against
+    the float32 matrix, which a loaded store only memory-maps from disk.
+    """
+
+    stores_text: bool = False
+    dtype: str = 'float32'  # 'float32', 'float16' or 'int8'
+    rescore_factor: int = 4
+
+    _matrix: np.ndarray = PrivateAttr(default=None)  # (capacity, dim) float32, first _size rows in use
+    _codes: np.ndarray = PrivateAttr(default=None)  # Quantized copy of _matrix, unless dtype is float32
+    _scales: np.ndarray = PrivateAttr(default=None)  # Per-row scale of int8 codes
+    _size: int = PrivateAttr(default=0)
+    _ids: list = PrivateAttr(default_factory=list)
+    _ref_doc_ids: list = PrivateAttr(default_factory=list)
+    _metadata: list = PrivateAttr(default_factory=list)
+    _rows: dict = PrivateAttr(default_factory=dict)  # node id -> row
+    _columns_shared: bool = PrivateAttr(default=False)  # Node columns also read by a NodeSnapshot
+
+    @classmethod
+    def class_name(cls):
+        return "NumpyVectorStore"
+
+    @property
+    def client(self):
+        return None
+
+    @property
+    def quantized(self):
+        return self.dtype != 'float32'
+
+    @property
+    def embeddings(self):
+        """Normalized float32 embeddings of the stored nodes, one row per node"""
+        if self._matrix is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self._matrix[:self._size]
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def columns(self):
+        """Ids, source document ids, metadata and rows of the stored nodes, in row order"""
+        return self._ids, self._ref_doc_ids, self._metadata, self._rows
+
+    def share_columns(self):
+        """Node columns for a NodeSnapshot of the same rows; the store copies them before changing them"""
+        self._columns_shared = True
+        return self.columns
+
+    def _own_columns(self):
+        if self._columns_shared:
+            self._ids, self._ref_doc_ids = list(self._ids), list(self._ref_doc_ids)
+            self._metadata, self._rows = list(self._metadata), dict(self._rows)
+            self._columns_shared = False
+
+    def resident_bytes(self):
+        """Memory held by the vectors a query reads and by the node columns
+
+        A flat float32 store scores every row, so its matrix stays in the page
+        cache even when memory-mapped; quantized stores only read a few mapped
+        rows to rescore.
+        """
+        resident = object_bytes(*self.columns)
+        if not self.quantized:
+            return resident + self.embeddings.nbytes
+        resident += self._codes[:self._size].nbytes if self._codes is not None else 0
+        resident += self._scales[:self._size].nbytes if self._scales is not None else 0
+        if not isinstance(self._matrix, np.memmap):
+            resident += self.embeddings.nbytes
+        return resident
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _quantize(self, vectors):
+        """Compact codes (and int8 scales) of normalized float32 vectors"""
+        if self.dtype == 'float16':
+            return vectors.astype(np.float16), None
+        if self.dtype == 'int8':
+            scales = np.maximum(np.abs(vectors).max(axis=-1), 1e-12) / 127
+            codes = np.round(vectors / scales[..., None]).astype(np.int8)
+            return codes, scales.astype(np.float32)
+        raise ValueError(f"Unsupported embedding dtype: {self.dtype}")
+
+    @staticmethod
+    def _grow(array, capacity, size):
+        grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+        grown[:size] = array[:size]
+        return grown
+
+    def _reserve(self, extra, dim):
+        """Grow the matrices geometrically so appends are amortized O(1)"""
+        if self._matrix is None:
+            capacity = max(extra, 64)
+            self._matrix = np.empty((capacity, dim), dtype=np.float32)
+            if self.quantized:
+                self._codes, self._scales = self._quantize(np.zeros((capacity, dim), dtype=np.float32))
+        elif self._size + extra > self._matrix.shape[0] or not self._matrix.flags.writeable:
+            # Also copies a read-only memory-mapped matrix before its first update
+            capacity = max(self._size + extra, 2 * self._matrix.shape[0])
+            self._matrix = self._grow(self._matrix, capacity, self._size)
+            if self.quantized:
+                self._codes = self._grow(self._codes, capacity, self._size)
+                if self._scales is not None:
+                    self._scales = self._grow(self._scales, capacity, self._size)
+
+    def _write_row(self, row, vector):
+        self._matrix[row] = vector
+        if self.quantized:
+            codes, scale = self._quantize(vector)
+            self._codes[row] = codes
+            if scale is not None:
+                self._scales[row] = scale
+
+    def add(self, nodes, **add_kwargs):
+        if not nodes:
+            return []
+        vectors = self._normalize([node.get_embedding() for node in nodes])
+        self._own_columns()
+        self._reserve(len(nodes), vectors.shape[1])
+        for node, vector in zip(nodes, vectors):
+            row = self._rows.get(node.node_id)
+            if row is None:
+                row = self._size
+                self._size += 1
+                self._ids.append(node.node_id)
+                self._ref_doc_ids.append(node.ref_doc_id)
+                self._metadata.append(dict(node.metadata))
+                self._rows[node.node_id] = row
+            else:
+                self._ref_doc_ids[row] = node.ref_doc_id
+                self._metadata[row] = dict(node.metadata)
+            self._write_row(row, vector)
+        return [node.node_id for node in nodes]
+
+    def _delete_row(self, row):
+        """Remove a row by moving the last row into its place"""
+        last = self._size - 1
+        del self._rows[self._ids[row]]
+        if row != last:
+            self._reserve(0, self._matrix.shape[1])
+            self._matrix[row] = self._matrix[last]
+            if self.quantized:
+                self._codes[row] = self._codes[last]
+                if self._scales is not None:
+                    self._scales[row] = self._scales[last]
+            self._ids[row] = self._ids[last]
+            self._ref_doc_ids[row] = self._ref_doc_ids[last]
+            self._metadata[row] = self._metadata[last]
+            self._rows[self._ids[row]] = row
+        self._ids.pop()
+        self._ref_doc_ids.pop()
+        self._metadata.pop()
+        self._size = last
+
+    def delete(self, ref_doc_id, **delete_kwargs):
+        """Delete every node of a source document (or a single node given its id)"""
+        rows = [row for row in range(self._size) if self._ref_doc_ids[row] == ref_doc_id]
+        if ref_doc_id in self._rows:
+            rows.append(self._rows[ref_doc_id])
+        if rows:
+            self._own_columns()
+        for row in sorted(set(rows), reverse=True):
+            self._delete_row(row)
+
+    def _candidate_rows(self, query):
+        """Rows allowed by the query's node id restriction and metadata filters, or None for all"""
+        rows = None
+        if query.node_ids is not None:
+            rows = [self._rows[node_id] for node_id in query.node_ids if node_id in self._rows]
+        if query.filters is not None:
+            rows = range(self._size) if rows is None else rows
+            rows = [row for row in rows if metadata_matches(self._metadata[row], query.filters)]
+        return None if rows is None else np.asarray(rows, dtype=np.int64)
+
+    @staticmethod
+    def _top_k(scores, k):
+        """Indices of the k best scores, best first"""
+        k = min(k, scores.shape[0])
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        best = np.argpartition(-scores, k - 1)[:k]
+        return best[np.argsort(-scores[best])]
+
+    def _score(self, query_vector, rows):
+        """Exact cosine similarity of the query with the given rows (all rows when None)"""
+        matrix = self.embeddings if rows is None else self.embeddings[rows]
+        return matrix @ query_vector
+
+    def _approximate_score(self, query_vector, rows):
+        """Similarity estimated from the quantized rows, decoded in blocks to bound memory"""
+        rows = np.arange(self._size) if rows is None else rows
+        scores = np.empty(rows.shape[0], dtype=np.float32)
+        for start in range(0, rows.shape[0], 8192):
+            block = rows[start:start + 8192]
+            scores[start:start + 8192] = self._codes[block].astype(np.float32) @ query_vector
+            if self._scales is not None:
+                scores[start:start + 8192] *= self._scales[block]
+        return scores
+
+    def _search(self, query_vector, rows, k):
+        """Top-k (rows, scores) among the given rows (all rows when None)"""
+        if not self.quantized:
+            scores = self._score(query_vector, rows)
+            best = self._top_k(scores, k)
+            return (best if rows is None else rows[best]), scores[best]
+
+        approximate = self._approximate_score(query_vector, rows)
+        candidates = self._top_k(approximate, k * self.rescore_factor)
+        candidates = candidates if rows is None else rows[candidates]
+        # Sorted rows keep reads from the memory-mapped float32 matrix sequential
+        candidates = np.sort(candidates)
+        scores = self._score(query_vector, candidates)
+        best = self._top_k(scores, k)
+        return candidates[best], scores[best]
+
+    def query(self, query, **kwargs):
+        if self._size == 0 or query.query_embedding is None:
+            return VectorStoreQueryResult(nodes=None, similarities=[], ids=[])
+
+        rows = self._candidate_rows(query)
+        if rows is not None and rows.size == 0:
+            return VectorStoreQueryResult(nodes=None, similarities=[], ids=[])
+
+        query_vector = self._normalize(query.query_embedding)
+        best_rows, scores = self._search(query_vector, rows, query.similarity_top_k)
+        return VectorStoreQueryResult(
+            nodes=None,
+            similarities=scores.tolist(),
+            ids=[self._ids[row] for row in best_rows]
+        )
+
+    def persist(self, persist_path, fs=None):
+        """Write the matrices as .npy files next to a JSON sidecar of ids and metadata"""
+        directory = os.path.dirname(persist_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        base_path = os.path.splitext(persist_path)[0]
+        np.save(base_path + '.npy', self.embeddings)
+        if self.quantized and self._codes is not None:
+            np.save(base_path + '.codes.npy', self._codes[:self._size])
+            if self._scales is not None:
+                np.save(base_path + '.scales.npy', self._scales[:self._size])
+        with open(persist_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "class_name": self.class_name(),
+                "params": self._persist_params(),
+                "ids": self._ids,
+                "ref_doc_ids": self._ref_doc_ids,
+                "metadata": pack_metadata(self._metadata),
+            }, f)
+
+    def _persist_params(self):
+        """Constructor parameters written to the sidecar"""
+        return {"dtype": self.dtype, "rescore_factor": self.rescore_factor}
+
+    @classmethod
+    def from_persist_path(cls, persist_path, **params):
+        """Load a persisted store; params override the persisted search parameters"""
+        with open(persist_path, encoding='utf-8') as f:
+            data = json.load(f)
+        store = cls(**{**data.get("params", {}), **params})
+        store._size = len(data["ids"])
+        store._ids = data["ids"]
+        store._ref_doc_ids = data["ref_doc_ids"]
+        metadata = data["metadata"]
+        # Sidecars written before metadata was stored by column hold one dict per node
+        store._metadata = metadata if isinstance(metadata, list) else unpack_metadata(metadata, store._size)
+        store._rows = {node_id: row for row, node_id in enumerate(store._ids)}
+        if not store._size:
+            return store
+
+        base_path = os.path.splitext(persist_path)[0]
+        # The float32 matrix is memory-mapped read-only: loading is instant, processes serving the
+        # same snapshot share its pages through the OS cache, and it is copied before any update
+        store._matrix = np.load(base_path + '.npy', mmap_mode='r')
+        if store.quantized:
+            # Only the compact codes are resident; exact rescoring reads mapped pages
+            store._codes = np.load(base_path + '.codes.npy')
+            if os.path.exists(base_path + '.scales.npy'):
+                store._scales = np.load(base_path + '.scales.npy')
+        return store
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir, **params):
+        return cls.from_persist_path(os.path.join(persist_dir, DEFAULT_PERSIST_FNAME), **params)
+
+
+class IVFFlatVectorStore(NumpyVectorStore):
+    """Approximate vector store partitioning embeddings into k-means cells (IVF-flat)
+
+    A query is compared with the cell centroids first, then scored exactly
+    against the rows of its `nprobe` closest cells only. Cells are trained
+    when the store is persisted or `train` is called, never by a query;
+    until then, and for stores smaller than `min_train_size`, queries are
+    searched exhaustively.
+    """
+
+    nlist: int = 256
+    nprobe: int = 8
+    train_iterations: int = 10
+    min_train_size: int = 4096
+
+    _centroids: np.ndarray = PrivateAttr(default=None)
+    _assignments: np.ndarray = PrivateAttr(default=None)  # cell of each row
+    _trained_size: int = PrivateAttr(default=0)
+    # (rows sorted by cell, start of each cell in them), replaced as a whole so queries never see a
+    # half-built pair; None until trained at persist or load time, and after rows changed
+    _lists: tuple = PrivateAttr(default=None)
+
+    @classmethod
+    def class_name(cls):
+        return "IVFFlatVectorStore"
+
+    def _persist_params(self):
+        return {
+            **super()._persist_params(),
+            "nlist": self.nlist,
+            "nprobe": self.nprobe,
+            "train_iterations": self.train_iterations,
+            "min_train_size": self.min_train_size,
+        }
+
+    def _assign(self, vectors):
+        """Closest centroid of each vector, computed in blocks to bound memory"""
+        cells = np.empty(vectors.shape[0], dtype=np.int32)
+        for start in range(0, vectors.shape[0], 8192):
+            block = vectors[start:start + 8192]
+            cells[start:start + 8192] = np.argmax(block @ self._centroids.T, axis=1)
+        return cells
+
+    def _train(self):
+        """Spherical k-means over the stored embeddings"""
+        vectors = self.embeddings
+        # Keep at least ~39 rows per cell so centroids are meaningful
+        nlist = max(1, min(self.nlist, vectors.shape[0] // 39))
+        rng = np.random.default_rng(0)
+        self._centroids = vectors[rng.choice(vectors.shape[0], nlist, replace=False)].copy()
+        for _ in range(self.train_iterations):
+            cells = self._assign(vectors)
+            counts = np.bincount(cells, minlength=nlist)
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            filled = counts > 0
+            sums = np.zeros_like(self._centroids)
+            sums[filled] = np.add.reduceat(vectors[np.argsort(cells, kind='stable')], starts[filled], axis=0)
+            # Reseed empty cells with random rows
+            empty = int((~filled).sum())
+            if empty:
+                sums[~filled] = vectors[rng.choice(vectors.shape[0], empty, replace=False)]
+            self._centroids = self._normalize(sums)
+        self._assignments = self._assign(vectors)
+        self._trained_size = vectors.shape[0]
+
+    def _build_lists(self):
+        order = np.argsort(self._assignments, kind='stable')
+        self._lists = (order, np.searchsorted(self._assignments[order], np.arange(self._centroids.shape[0] + 1)))
+
+    def _ensure_trained(self):
+        """Train once the store is large enough, and retrain after it doubled in size
+
+        Only called when persisting, never by queries: shards are shared
+        read-only by the sessions querying them.
+        """
+        if self._size < self.min_train_size:
+            return False
+        if self._centroids is None or self._size > 2 * self._trained_size:
+            self._train()
+        elif self._assignments.shape[0] < self._size:
+            # Rows added since training go to their closest existing cell
+            known = self._assignments.shape[0]
+            self._assignments = np.concatenate([self._assignments, self._assign(self.embeddings[known:])])
+        if self._lists is None:
+            self._build_lists()
+        return True
+
+    def train(self):
+        """Train the cells and build their lists, as persisting does; returns whether the store is large enough"""
+        return self._ensure_trained()
+
+    def add(self, nodes, **add_kwargs):
+        self._lists = None
+        return super().add(nodes, **add_kwargs)
+
+    def _delete_row(self, row):
+        if self._assignments is not None:
+            last = self._size - 1
+            if last < self._assignments.shape[0]:
+                self._assignments[row] = self._assignments[last]
+                self._assignments = self._assignments[:last]
+            else:
+                # The row moved into place was never assigned: assign it again lazily
+                self._assignments = self._assignments[:min(row, self._assignments.shape[0])]
+        self._lists = None
+        super()._delete_row(row)
+
+    def resident_bytes(self):
+        return super().resident_bytes() + object_bytes(self._centroids, self._assignments, self._lists)
+
+    def _probe_rows(self, query_vector, lists):
+        """Rows of the cells closest to the query"""
+        order, bounds = lists
+        nprobe = min(self.nprobe, self._centroids.shape[0])
+        cells = self._top_k(self._centroids @ query_vector, nprobe)
+        return np.concatenate([order[bounds[cell]:bounds[cell + 1]] for cell in cells])
+
+    def query(self, query, **kwargs):
+        lists = self._lists
+        # Filtered queries are already narrowed down, score them exactly, as untrained stores
+        if lists is None or query.node_ids is not None or query.filters is not None or query.query_embedding is None:
+            return super().query(query, **kwargs)
+
+        query_vector = self._normalize(query.query_embedding)
+        best_rows, scores = self._search(query_vector, self._probe_rows(query_vector, lists), query.similarity_top_k)
+        return VectorStoreQueryResult(
+            nodes=None,
+            similarities=scores.tolist(),
+            ids=[self._ids[row] for row in best_rows]
+        )
+
+    def persist(self, persist_path, fs=None):
+        super().persist(persist_path, fs=fs)
+        if self.train():
+            np.savez(
+                os.path.splitext(persist_path)[0] + '.ivf.npz',
+                centroids=self._centroids,
+                assignments=self._assignments,
+                trained_size=self._trained_size
+            )
+
+    @classmethod
+    def from_persist_path(cls, persist_path, **params):
+        store = super().from_persist_path(persist_path, **params)
+        ivf_path = os.path.splitext(persist_path)[0] + '.ivf.npz'
+        if os.path.exists(ivf_path):
+            with np.load(ivf_path) as ivf:
+                store._centroids = ivf["centroids"]
+                store._assignments = ivf["assignments"]
+                store._trained_size = int(ivf["trained_size"])
+            if store._assignments.shape[0] == store._size:
+                store._build_lists()
+        return store
+
+
+VECTOR_STORES = {
+    "flat": NumpyVectorStore,
+    "ivf": IVFFlatVectorStore,
+}
+
+
+def create_vector_store(kind, **params):
+    """Create an empty vector store of a kind listed in VECTOR_STORES"""
+    return VECTOR_STORES[kind](**params)
+
+
+def load_vector_store(persist_dir, **search_params):
+    """Load a persisted vector store, whatever its kind, with the given search parameters"""
+    persist_path = os.path.join(persist_dir, DEFAULT_PERSIST_FNAME)
+    with open(persist_path, encoding='utf-8') as f:
+        class_name = json.load(f)["class_name"]
+    for store_class in VECTOR_STORES.values():
+        if store_class.class_name() == class_name:
+            params = {key: value for key, value in search_params.items() if key in store_class.model_fields}
+            return store_class.from_persist_path(persist_path, **params)
+    raise ValueError(f"Unknown vector store: {class_name}")